@@ -41,7 +41,8 @@ def build_executable():
     # Copy necessary server files
     server_files = [
         "server/simplified_app.py",
-        "server/mock_services.py"
+        "server/mock_services.py",
+        "server/write_queue.py"
     ]
     
     for file_path in server_files:
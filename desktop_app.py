@@ -1042,16 +1042,18 @@ def start_server():
             cwd=os.path.dirname(server_script)
         )
         
-        # Wait for the server to start
-        for _ in range(50):  # 5 seconds timeout
+        # Wait for the server to start; it answers health checks before any
+        # model has finished loading, which /api/ready reports separately
+        for _ in range(300):  # 30 seconds timeout
             try:
-                response = requests.get("http://localhost:5000/")
+                response = requests.get("http://localhost:5000/api/health", timeout=1)
                 if response.status_code == 200:
                     server_ready = True
                     print("Server started successfully")
                     return True
             except:
-                time.sleep(0.1)
+                pass
+            time.sleep(0.1)
         
         # Server didn't start in time
         print("Server failed to start in time")
@@ -0,0 +1,126 @@
+import logging
+from collections import OrderedDict
+from threading import Lock
+from peft import PeftModel
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class AdapterRegistry:
+    def __init__(self, max_loaded=4):
+        """
+        Initialize the adapter registry.
+        
+        Named LoRA adapters are loaded side by side onto one PeftModel that
+        wraps a single copy of the base weights, so each extra adapter only
+        costs its own low-rank matrices. The least recently used adapter is
+        unloaded once more than max_loaded are resident.
+        
+        The base copy is built by the caller with set_base(), off the
+        inference worker, since copying the weights takes a while. Only the
+        inference worker may call activate(), since switching the active
+        adapter affects every forward pass on the shared model.
+        
+        Args:
+            max_loaded (int): Maximum number of named adapters kept loaded.
+        """
+        self.max_loaded = max_loaded
+        
+        self.base = None  # Copy of the base weights at the inference precision
+        self.model = None  # Shared PeftModel wrapping the base, created on first use
+        self.loaded = OrderedDict()  # adapter name -> path
+        
+        # Bumped by reset(), so a base built for an older model is dropped
+        self.generation = 0
+        self.lock = Lock()
+        
+        self.stats = {
+            'hits': 0,
+            'loads': 0,
+            'evictions': 0
+        }
+    
+    def has_base(self):
+        """Check if the base model to load adapters onto has been set."""
+        with self.lock:
+            return self.base is not None or self.model is not None
+    
+    def set_base(self, base, generation):
+        """
+        Set the base model adapters are loaded onto.
+        
+        Args:
+            base: A plain (non-PEFT) copy of the base model, ready for inference.
+            generation (int): self.generation when the copy was started.
+        
+        Returns:
+            bool: False if the registry was reset meanwhile and the copy was dropped.
+        """
+        with self.lock:
+            if generation != self.generation:
+                return False
+            if self.base is None and self.model is None:
+                self.base = base
+            return True
+    
+    def activate(self, name, path):
+        """
+        Make a named adapter the active one, loading it if needed.
+        
+        Args:
+            name (str): Adapter name.
+            path (str): Directory the adapter was saved to.
+        
+        Returns:
+            The shared model with the adapter active.
+        """
+        with self.lock:
+            if name in self.loaded:
+                self.loaded.move_to_end(name)
+                self.stats['hits'] += 1
+            else:
+                logger.info(f"Loading adapter {name} from {path}")
+                if self.model is None:
+                    if self.base is None:
+                        raise ValueError("No base model has been set for adapters")
+                    
+                    # The first adapter wraps the base; later ones are added to the same model
+                    self.model = PeftModel.from_pretrained(self.base, path, adapter_name=name)
+                    self.base = None
+                else:
+                    self.model.load_adapter(path, adapter_name=name)
+                
+                self.loaded[name] = path
+                self.stats['loads'] += 1
+                
+                # Evict only after loading, so the model never runs out of adapters
+                while len(self.loaded) > self.max_loaded:
+                    evicted, _ = self.loaded.popitem(last=False)
+                    self.model.delete_adapter(evicted)
+                    self.stats['evictions'] += 1
+                    logger.info(f"Unloaded adapter {evicted}")
+            
+            if self.model.active_adapter != name:
+                self.model.set_adapter(name)
+            if self.model.training:
+                self.model.eval()
+            return self.model
+    
+    def reset(self):
+        """Drop the base, the shared model and every loaded adapter, e.g. after a new base model is loaded."""
+        with self.lock:
+            self.generation += 1
+            self.base = None
+            self.model = None
+            self.loaded.clear()
+    
+    def get_stats(self):
+        """Get the loaded adapters and load/eviction counters."""
+        with self.lock:
+            stats = dict(self.stats)
+            stats['loaded'] = list(self.loaded)
+        return stats
@@ -1,4 +1,4 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, Response, stream_with_context
 import os
 import logging
 from flask_cors import CORS
@@ -6,6 +6,9 @@ import threading
 import uuid
 import time
 import json
+import sys
+import atexit
+import signal
 
 # Import local modules
 from model_service import ModelService
@@ -35,6 +38,73 @@ download_tasks = {}
 training_tasks = {}
 sync_tasks = {}
 
+# State of the model load that runs in the background at startup
+model_loading = {
+    'status': 'idle',  # idle, loading, ready or failed
+    'model_id': None,
+    'start_time': None,
+    'end_time': None,
+    'error': None
+}
+server_start_time = time.time()
+
+def load_model_task(model_id, model_path):
+    """Load and warm up a model, recording progress in model_loading."""
+    model_loading.update({
+        'status': 'loading',
+        'model_id': model_id,
+        'start_time': time.time(),
+        'end_time': None,
+        'error': None
+    })
+    
+    try:
+        model_service.load_model(model_id, model_path)
+        model_service.warm_up()
+        
+        model_loading['status'] = 'ready'
+        logger.info(f"Loaded model {model_id} from {model_path}")
+    except Exception as e:
+        logger.error(f"Failed to load model: {str(e)}")
+        model_loading['status'] = 'failed'
+        model_loading['error'] = str(e)
+    finally:
+        model_loading['end_time'] = time.time()
+
+def model_loading_response():
+    """Get a 503 response while the model is still loading, or None."""
+    if model_loading['status'] != 'loading':
+        return None
+    
+    response = jsonify({
+        "error": "Model is loading",
+        "model_id": model_loading['model_id']
+    })
+    response.status_code = 503
+    response.headers['Retry-After'] = '5'
+    return response
+
+@app.route('/api/health', methods=['GET'])
+def health():
+    return jsonify({
+        "status": "ok",
+        "uptime": time.time() - server_start_time
+    })
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    # Ready once no model load is in flight; a failed load still lets the
+    # app serve everything that doesn't need the model
+    status = dict(model_loading)
+    status['ready'] = status['status'] != 'loading'
+    status['model_loaded'] = model_service.is_model_loaded()
+    
+    response = jsonify(status)
+    if not status['ready']:
+        response.status_code = 503
+        response.headers['Retry-After'] = '5'
+    return response
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     try:
@@ -42,6 +112,10 @@ def chat():
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
+        loading = model_loading_response()
+        if loading is not None:
+            return loading
+        
         message = data.get('message')
         conversation_id = data.get('conversation_id')
         
@@ -50,32 +124,29 @@ def chat():
         
         # Get conversation history from the database
         conversation = database.get_conversation(conversation_id)
-        if not conversation:
-            # Create a new conversation if it doesn't exist
-            conversation = {
-                'id': conversation_id,
-                'messages': []
-            }
+        history = conversation['messages'] if conversation else []
         
-        # Add user message to the conversation
-        conversation['messages'].append({
+        # Add user message to the history
+        user_message = {
             'role': 'user',
             'content': message,
             'timestamp': time.time()
-        })
+        }
+        history.append(user_message)
         
         # Get response from the model
-        response = model_service.generate_response(message, conversation['messages'])
+        response = model_service.generate_response(
+            message, history, conversation_id=conversation_id, adapter=data.get('adapter')
+        )
         
-        # Add assistant's response to the conversation
-        conversation['messages'].append({
+        assistant_message = {
             'role': 'assistant',
             'content': response,
             'timestamp': time.time()
-        })
+        }
         
-        # Save the updated conversation
-        database.save_conversation(conversation)
+        # Append only the two new messages to the stored conversation
+        database.append_messages(conversation_id, [user_message, assistant_message])
         
         return jsonify({"response": response})
     
@@ -83,6 +154,116 @@ def chat():
         logger.error(f"Error in chat endpoint: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/chat/stream', methods=['POST'])
+def chat_stream():
+    try:
+        data = request.json
+        if not data:
+            return jsonify({"error": "No data provided"}), 400
+        
+        loading = model_loading_response()
+        if loading is not None:
+            return loading
+        
+        message = data.get('message')
+        conversation_id = data.get('conversation_id')
+        
+        if not message:
+            return jsonify({"error": "No message provided"}), 400
+        
+        if not model_service.is_model_loaded():
+            return jsonify({"error": "No model is loaded"}), 400
+        
+        # Get conversation history from the database
+        conversation = database.get_conversation(conversation_id)
+        history = conversation['messages'] if conversation else []
+        
+        user_message = {
+            'role': 'user',
+            'content': message,
+            'timestamp': time.time()
+        }
+        history.append(user_message)
+        
+        def events():
+            pieces = []
+            try:
+                for text in model_service.generate_response_stream(
+                    message, history, conversation_id=conversation_id, adapter=data.get('adapter')
+                ):
+                    pieces.append(text)
+                    yield f"data: {json.dumps({'token': text})}\n\n"
+            except Exception as e:
+                logger.error(f"Error in chat stream: {str(e)}")
+                yield f"event: error\ndata: {json.dumps({'error': str(e)})}\n\n"
+                return
+            
+            response = ''.join(pieces).strip()
+            assistant_message = {
+                'role': 'assistant',
+                'content': response,
+                'timestamp': time.time()
+            }
+            
+            # Persist the turn once the full response is known
+            database.append_messages(conversation_id, [user_message, assistant_message])
+            
+            yield f"event: done\ndata: {json.dumps({'response': response})}\n\n"
+        
+        return Response(
+            stream_with_context(events()),
+            mimetype='text/event-stream',
+            headers={
+                'Cache-Control': 'no-cache',
+                'X-Accel-Buffering': 'no'  # Stop reverse proxies from buffering the stream
+            }
+        )
+    
+    except Exception as e:
+        logger.error(f"Error in chat stream endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/conversations', methods=['GET'])
+def list_conversations():
+    try:
+        limit = min(max(request.args.get('limit', 50, type=int), 1), 200)
+        cursor = request.args.get('cursor')
+        
+        try:
+            page = database.list_conversation_summaries(limit=limit, after_cursor=cursor)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        return jsonify(page)
+    
+    except Exception as e:
+        logger.error(f"Error in list conversations endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/conversations/search', methods=['GET'])
+def search_conversations():
+    try:
+        query = request.args.get('q', '').strip()
+        if not query:
+            return jsonify({"error": "No search query provided"}), 400
+        
+        limit = min(max(request.args.get('limit', 20, type=int), 1), 100)
+        results = database.search_messages(query, limit=limit)
+        
+        return jsonify({"results": results})
+    
+    except Exception as e:
+        logger.error(f"Error in search conversations endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/database/stats', methods=['GET'])
+def database_stats():
+    try:
+        return jsonify(database.get_cache_stats())
+    except Exception as e:
+        logger.error(f"Error in database stats endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/model/status', methods=['GET'])
 def model_status():
     try:
@@ -101,6 +282,63 @@ def model_info():
         logger.error(f"Error in model info endpoint: {str(e)}")
         return jsonify({"error": str(e)}), 500
 
+@app.route('/api/model/adapters', methods=['GET'])
+def model_adapters():
+    try:
+        adapters = model_service.list_adapters()
+        return jsonify({"adapters": adapters})
+    except Exception as e:
+        logger.error(f"Error in model adapters endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/model/speculative', methods=['POST'])
+def model_speculative():
+    try:
+        data = request.json
+        if not data or ('enabled' not in data and 'prompt_lookup' not in data):
+            return jsonify({"error": "No enabled or prompt_lookup flag provided"}), 400
+        
+        if 'enabled' in data:
+            try:
+                model_service.set_speculative_decoding(bool(data['enabled']), data.get('draft_model_id'))
+            except ValueError as e:
+                return jsonify({"error": str(e)}), 400
+            
+            database.save_setting('speculative_models', model_service.speculative_models)
+        
+        if 'prompt_lookup' in data:
+            model_service.set_prompt_lookup(bool(data['prompt_lookup']))
+            database.save_setting('prompt_lookup', bool(data['prompt_lookup']))
+        
+        return jsonify({
+            "success": True,
+            "speculative": model_service.draft_model.get_stats() if model_service.draft_model else None,
+            "prompt_lookup": model_service.prompt_lookup.get_stats() if model_service.prompt_lookup else None
+        })
+    except Exception as e:
+        logger.error(f"Error in model speculative endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
+@app.route('/api/model/precision', methods=['POST'])
+def model_precision():
+    try:
+        data = request.json
+        if not data or 'precision' not in data:
+            return jsonify({"error": "No precision provided"}), 400
+        
+        precision = data['precision']
+        try:
+            model_service.set_inference_precision(precision)
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+        
+        database.save_setting('inference_precision', precision)
+        
+        return jsonify({"success": True, "precision": model_service.get_active_precision()})
+    except Exception as e:
+        logger.error(f"Error in model precision endpoint: {str(e)}")
+        return jsonify({"error": str(e)}), 500
+
 @app.route('/api/model/available', methods=['GET'])
 def available_models():
     try:
@@ -156,7 +394,7 @@ def download_model():
                 })
                 
                 # Load the model
-                model_service.load_model(model_id, model_path)
+                load_model_task(model_id, model_path)
                 
             except Exception as e:
                 logger.error(f"Error in download task: {str(e)}")
@@ -203,10 +441,14 @@ def model_inference():
         if not data:
             return jsonify({"error": "No data provided"}), 400
         
+        loading = model_loading_response()
+        if loading is not None:
+            return loading
+        
         messages = data.get('messages', [])
         
         # Generate response using the model
-        response = model_service.generate_response_from_messages(messages)
+        response = model_service.generate_response_from_messages(messages, adapter=data.get('adapter'))
         
         return jsonify({"response": response})
     
@@ -224,6 +466,10 @@ def start_training():
         training_data = data.get('training_data', [])
         settings = data.get('settings', {})
         
+        loading = model_loading_response()
+        if loading is not None:
+            return loading
+        
         # Ensure model is loaded
         if not model_service.is_model_loaded():
             return jsonify({"error": "No model loaded for training"}), 400
@@ -231,6 +477,12 @@ def start_training():
         # Generate a unique task ID
         task_id = str(uuid.uuid4())
         
+        # 'full' retrains on the whole history; 'incremental' only trains on
+        # messages newer than the last run's watermark
+        training_mode = settings.get('training_mode', 'full')
+        if training_mode not in ('full', 'incremental'):
+            return jsonify({"error": f"Unknown training mode: {training_mode}"}), 400
+        
         # Start training in a background thread
         def training_task():
             try:
@@ -243,15 +495,31 @@ def start_training():
                 learning_rate = settings.get('learning_rate', 0.0001)
                 use_local_data = settings.get('use_local_data', True)
                 
-                # If using local data but none provided, load from database
-                if use_local_data and not training_data:
-                    conversations = database.get_all_conversations()
-                    training_data = model_service.prepare_training_data(conversations)
+                replay_fraction = settings.get('replay_fraction', 0.0)
+                watermark = None
                 
-                if not training_data:
+                # If using local data but none provided, stream pairs from the database;
+                # each epoch starts a fresh pass so nothing is held in memory
+                if use_local_data and not training_data:
+                    after_id = None
+                    if training_mode == 'incremental':
+                        after_id = database.get_training_watermark(model_service.model_id)
+                    
+                    # Messages arriving during training are left for the next run
+                    watermark = database.get_message_watermark()
+                    
+                    epoch_data = lambda: database.iter_training_pairs(
+                        after_id=after_id,
+                        until_id=watermark,
+                        replay_fraction=replay_fraction
+                    )
+                elif training_data:
+                    epoch_data = lambda: training_data
+                else:
                     raise ValueError("No training data available")
                 
                 # Fine-tune the model with LoRA
+                num_examples = 0
                 for epoch in range(num_epochs):
                     epoch_progress = (epoch / num_epochs) * 100
                     training_tasks[task_id]['progress'] = epoch_progress
@@ -260,11 +528,15 @@ def start_training():
                     
                     # Perform one epoch of training
                     model_service.train_epoch(
-                        training_data, 
+                        epoch_data(), 
                         batch_size=batch_size, 
                         learning_rate=learning_rate
                     )
                     
+                    num_examples = model_service.last_epoch_examples
+                    if not num_examples:
+                        raise ValueError("No training data available")
+                    
                     # Add a small delay to simulate work
                     time.sleep(1)
                 
@@ -281,7 +553,10 @@ def start_training():
                     'epochs': num_epochs,
                     'batch_size': batch_size,
                     'learning_rate': learning_rate,
-                    'num_examples': len(training_data),
+                    'num_examples': num_examples,
+                    'model_id': model_service.model_id,
+                    'training_mode': training_mode,
+                    'watermark': watermark,
                     'adapter_path': adapter_path,
                     'completion_time': time.time()
                 })
@@ -297,7 +572,8 @@ def start_training():
             'status': 'starting',
             'progress': 0,
             'start_time': time.time(),
-            'settings': settings
+            'settings': settings,
+            'training_mode': training_mode
         }
         
         # Start the training thread
@@ -305,7 +581,8 @@ def start_training():
         
         return jsonify({
             "message": "Training started",
-            "training_id": task_id
+            "training_id": task_id,
+            "training_mode": training_mode
         })
         
     except Exception as e:
@@ -344,6 +621,10 @@ def start_sync():
         privacy_settings = data.get('privacy_settings', {})
         sync_frequency = data.get('sync_frequency', 'manual')
         
+        loading = model_loading_response()
+        if loading is not None:
+            return loading
+        
         # Ensure model is loaded
         if not model_service.is_model_loaded():
             return jsonify({"error": "No model loaded for syncing"}), 400
@@ -385,7 +666,10 @@ def start_sync():
                 
                 sync_tasks[task_id]['status'] = 'completed'
                 sync_tasks[task_id]['progress'] = 100
-                sync_tasks[task_id]['server_response'] = server_response
+                # The progress endpoint only needs the outcome, not the returned weights
+                sync_tasks[task_id]['server_response'] = {
+                    key: value for key, value in server_response.items() if key != 'updated_weights'
+                }
                 
                 # Save sync metadata to the database
                 database.save_sync_metadata({
@@ -467,14 +751,42 @@ if __name__ == '__main__':
         # Initialize the database
         database.initialize()
         
-        # Try to load a model if one was previously downloaded
+        # Group-commit writes in the background unless a stricter mode is configured
+        database.set_durability_mode(database.get_setting('durability_mode', 'write_behind'))
+        
+        # Flush queued writes on shutdown, including on SIGTERM
+        atexit.register(database.close)
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        
+        # Bring legacy rows up to the current storage format without blocking chat
+        database.start_migrations()
+        
+        # Optional cap on prompt tokens, below the model's own context size
+        model_service.max_context_tokens = database.get_setting('max_context_tokens')
+        model_service.stop_sequences = database.get_setting('stop_sequences', model_service.stop_sequences)
+        model_service.inference_precision = database.get_setting('inference_precision', 'fp32')
+        model_service.adapters.max_loaded = database.get_setting('max_loaded_adapters', 4)
+        model_service.speculative_models.update(database.get_setting('speculative_models', {}))
+        model_service.set_prompt_lookup(database.get_setting('prompt_lookup', False))
+        model_service.engine.prefill_chunk_size = database.get_setting('prefill_chunk_size', 256)
+        model_service.inference_workers = database.get_setting('inference_workers', 1)
+        
+        # Fork inference workers before any torch op runs; each loaded model is sent to them
+        try:
+            model_service.start_workers()
+        except Exception as e:
+            logger.error(f"Failed to start inference workers, serving in-process: {str(e)}")
+        
+        # Load a previously downloaded model in the background so the server
+        # answers health checks right away; /api/ready reports when it's warm
         model_metadata = database.get_latest_model_metadata()
         if model_metadata and 'path' in model_metadata:
-            try:
-                model_service.load_model(model_metadata['id'], model_metadata['path'])
-                logger.info(f"Loaded model {model_metadata['id']} from {model_metadata['path']}")
-            except Exception as e:
-                logger.error(f"Failed to load model: {str(e)}")
+            model_loading['status'] = 'loading'
+            threading.Thread(
+                target=load_model_task,
+                args=(model_metadata['id'], model_metadata['path']),
+                daemon=True
+            ).start()
         
         # Start the Flask server
         app.run(host='0.0.0.0', port=5000)
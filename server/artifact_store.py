@@ -0,0 +1,86 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+import tempfile
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class ArtifactStore:
+    def __init__(self, root=None):
+        """
+        Initialize the artifact store.
+        
+        Artifacts are JSON-serializable values (such as weight dictionaries)
+        written once to a file named after the SHA-256 of their content, so
+        identical artifacts are stored only once and rows can reference them
+        by hash.
+        
+        Args:
+            root (str, optional): Directory for artifact files.
+                                  If None, defaults to 'data/artifacts'.
+        """
+        self.root = root or os.path.join('data', 'artifacts')
+        os.makedirs(self.root, exist_ok=True)
+    
+    def put(self, value):
+        """
+        Store a value and return its content hash.
+        
+        Args:
+            value: A JSON-serializable value.
+        
+        Returns:
+            str: The hex SHA-256 of the serialized value.
+        """
+        serialized = json.dumps(value, separators=(',', ':'), sort_keys=True).encode('utf-8')
+        digest = hashlib.sha256(serialized).hexdigest()
+        path = self.path(digest)
+        
+        if os.path.exists(path):
+            return digest
+        
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        
+        # Write to a temporary file first so readers never see a partial artifact
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(gzip.compress(serialized, compresslevel=6))
+            os.replace(temp_path, path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        
+        logger.info(f"Stored artifact {digest} ({len(serialized)} bytes)")
+        return digest
+    
+    def get(self, digest):
+        """
+        Load a stored value by its hash.
+        
+        Returns:
+            The stored value, or None if no artifact has that hash.
+        """
+        path = self.path(digest)
+        if not os.path.exists(path):
+            return None
+        
+        with open(path, 'rb') as f:
+            return json.loads(gzip.decompress(f.read()))
+    
+    def exists(self, digest):
+        """Check whether an artifact with the given hash is stored."""
+        return os.path.exists(self.path(digest))
+    
+    def path(self, digest):
+        """Get the file path for an artifact hash."""
+        # Fan out into subdirectories so no single directory grows too large
+        return os.path.join(self.root, digest[:2], f"{digest}.json.gz")
@@ -0,0 +1,158 @@
+from collections import OrderedDict
+from threading import Lock
+
+class ContextBuilder:
+    # Prompt line prefix for each role; messages with other roles are skipped
+    ROLE_PREFIXES = {
+        'user': "User: ",
+        'assistant': "Assistant: "
+    }
+    
+    def __init__(self, tokenizer, max_tokens=1024, reserve_tokens=100,
+                 max_cached_messages=4096, slack_fraction=0.25):
+        """
+        Initialize the context builder.
+        
+        Builds prompt token IDs from the newest messages of a conversation
+        that fit in the token budget. Every message is tokenized once and its
+        token IDs are cached, so a new turn only tokenizes the new messages.
+        
+        Args:
+            tokenizer: The tokenizer of the loaded model.
+            max_tokens (int): Context size of the model.
+            reserve_tokens (int): Tokens kept free for the generated reply.
+            max_cached_messages (int): Maximum number of cached tokenized messages.
+            slack_fraction (float): Share of the budget freed when old messages
+                                    have to be dropped, so the start of the
+                                    window (and the reusable KV cache) stays
+                                    put for the next few turns.
+        """
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.reserve_tokens = reserve_tokens
+        self.max_cached_messages = max_cached_messages
+        self.slack_fraction = slack_fraction
+        
+        self.token_cache = OrderedDict()  # (role, content) -> token IDs
+        self.window_starts = OrderedDict()  # conversation_id -> index of the first message in the window
+        self.lock = Lock()
+        
+        self.suffix_ids = self.tokenizer.encode(self.ROLE_PREFIXES['assistant'])
+        
+        self.stats = {
+            'builds': 0,
+            'cached_messages': 0,
+            'tokenized_messages': 0,
+            'truncated_builds': 0
+        }
+    
+    @property
+    def budget(self):
+        """Number of tokens available for conversation messages."""
+        return max(self.max_tokens - self.reserve_tokens - len(self.suffix_ids), 1)
+    
+    def build(self, messages, conversation_id=None):
+        """
+        Build prompt token IDs for a conversation.
+        
+        Args:
+            messages (list): The conversation messages, oldest first.
+            conversation_id (str, optional): Used to keep the window start stable across turns.
+        
+        Returns:
+            list: Token IDs of the newest messages that fit, followed by the assistant prefix.
+        """
+        encoded = [
+            self.encode_message(message.get('role', 'user'), message.get('content', ''))
+            for message in messages
+        ]
+        lengths = [len(ids) for ids in encoded]
+        budget = self.budget
+        
+        start = self._window_start(conversation_id, lengths, budget)
+        
+        token_ids = []
+        for ids in encoded[start:]:
+            token_ids.extend(ids)
+        
+        # A single message longer than the budget keeps only its tail
+        if len(token_ids) > budget:
+            token_ids = token_ids[-budget:]
+        
+        with self.lock:
+            self.stats['builds'] += 1
+            if start > 0 or sum(lengths) > budget:
+                self.stats['truncated_builds'] += 1
+        
+        return token_ids + self.suffix_ids
+    
+    def encode_message(self, role, content):
+        """
+        Get the token IDs of one formatted message line, tokenizing it only once.
+        
+        Returns:
+            list: Token IDs, empty for roles that aren't part of the prompt.
+        """
+        prefix = self.ROLE_PREFIXES.get(role)
+        if prefix is None:
+            return []
+        
+        key = (role, content)
+        with self.lock:
+            ids = self.token_cache.get(key)
+            if ids is not None:
+                self.token_cache.move_to_end(key)
+                self.stats['cached_messages'] += 1
+                return ids
+        
+        ids = self.tokenizer.encode(f"{prefix}{content}\n")
+        
+        with self.lock:
+            self.token_cache[key] = ids
+            self.stats['tokenized_messages'] += 1
+            while len(self.token_cache) > self.max_cached_messages:
+                self.token_cache.popitem(last=False)
+        
+        return ids
+    
+    def clear(self):
+        """Drop cached token IDs, e.g. after the tokenizer changes."""
+        with self.lock:
+            self.token_cache.clear()
+            self.window_starts.clear()
+    
+    def get_stats(self):
+        """Get tokenization cache statistics."""
+        with self.lock:
+            stats = dict(self.stats)
+            encoded = stats['cached_messages'] + stats['tokenized_messages']
+            stats['hit_rate'] = stats['cached_messages'] / encoded if encoded else 0
+            stats['entries'] = len(self.token_cache)
+            stats['budget'] = self.budget
+            return stats
+    
+    def _window_start(self, conversation_id, lengths, budget):
+        """Pick the index of the oldest message to include."""
+        with self.lock:
+            start = self.window_starts.get(conversation_id, 0) if conversation_id else 0
+        
+        # History may have been replaced by a shorter one
+        if start >= len(lengths):
+            start = 0
+        
+        total = sum(lengths[start:])
+        if total > budget:
+            # Drop old messages until there is some room to grow again
+            target = budget * (1 - self.slack_fraction)
+            while start < len(lengths) - 1 and total > target:
+                total -= lengths[start]
+                start += 1
+        
+        if conversation_id:
+            with self.lock:
+                self.window_starts[conversation_id] = start
+                self.window_starts.move_to_end(conversation_id)
+                while len(self.window_starts) > self.max_cached_messages:
+                    self.window_starts.popitem(last=False)
+        
+        return start
@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from threading import Lock
+
+class ConversationCache:
+    # Rough per-message overhead of the dict and its keys, in bytes
+    MESSAGE_OVERHEAD = 200
+    
+    def __init__(self, max_entries=256, max_bytes=64 * 1024 * 1024):
+        """
+        Initialize the conversation cache.
+        
+        Keeps decoded conversations in least-recently-used order, bounded
+        both by number of conversations and by their approximate size.
+        
+        Args:
+            max_entries (int): Maximum number of cached conversations.
+            max_bytes (int): Maximum approximate size of all cached conversations.
+        """
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        
+        self.entries = OrderedDict()  # conversation_id -> (conversation, size)
+        self.total_bytes = 0
+        self.lock = Lock()
+        
+        # Bumped whenever a conversation changes without its cache entry being updated,
+        # so a load that started before the change can't cache stale data
+        self.write_seq = 0
+        
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, conversation_id):
+        """
+        Get a copy of a cached conversation.
+        
+        Returns:
+            dict: The conversation, or None on a cache miss.
+        """
+        with self.lock:
+            entry = self.entries.get(conversation_id)
+            if entry is None:
+                self.misses += 1
+                return None
+            
+            self.entries.move_to_end(conversation_id)
+            self.hits += 1
+            return self._copy(entry[0])
+    
+    def load_token(self):
+        """Get a token to pass to put() for a conversation about to be loaded from disk."""
+        with self.lock:
+            return self.write_seq
+    
+    def put(self, conversation, token=None):
+        """
+        Cache a conversation.
+        
+        Args:
+            conversation (dict): The full conversation, including its messages.
+            token (int, optional): From load_token(); the conversation is not cached
+                                   if anything was written since the token was taken.
+        """
+        conversation_id = conversation.get('id')
+        if not conversation_id:
+            return
+        
+        conversation = self._copy(conversation)
+        size = self._estimate_size(conversation['messages'])
+        
+        with self.lock:
+            if token is None:
+                # A write-through: invalidates loads that are still in flight
+                self.write_seq += 1
+            elif token != self.write_seq:
+                return
+            
+            self._remove(conversation_id)
+            if size > self.max_bytes:
+                return
+            
+            self.entries[conversation_id] = (conversation, size)
+            self.total_bytes += size
+            self._evict()
+    
+    def append(self, conversation_id, messages):
+        """Append messages to a cached conversation, if it is cached."""
+        with self.lock:
+            entry = self.entries.get(conversation_id)
+            if entry is None:
+                # Loads in flight may have read the conversation before these messages
+                self.write_seq += 1
+                return
+            
+            conversation, size = entry
+            conversation['messages'].extend(dict(message) for message in messages)
+            added = self._estimate_size(messages)
+            
+            self.entries[conversation_id] = (conversation, size + added)
+            self.entries.move_to_end(conversation_id)
+            self.total_bytes += added
+            self._evict()
+    
+    def invalidate(self, conversation_id):
+        """Drop a conversation from the cache."""
+        with self.lock:
+            self.write_seq += 1
+            self._remove(conversation_id)
+    
+    def get_stats(self):
+        """Get hit/miss counters and the current size of the cache."""
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0,
+                'evictions': self.evictions,
+                'entries': len(self.entries),
+                'bytes': self.total_bytes
+            }
+    
+    def _remove(self, conversation_id):
+        """Remove an entry; the caller must hold the lock."""
+        entry = self.entries.pop(conversation_id, None)
+        if entry is not None:
+            self.total_bytes -= entry[1]
+    
+    def _evict(self):
+        """Evict least recently used entries until within bounds; the caller must hold the lock."""
+        while self.entries and (len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes):
+            _, (_, size) = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+    
+    def _copy(self, conversation):
+        """Copy a conversation so callers can modify it without touching the cache."""
+        copied = dict(conversation)
+        copied['messages'] = [dict(message) for message in conversation.get('messages', [])]
+        return copied
+    
+    def _estimate_size(self, messages):
+        """Approximate the memory used by a list of messages."""
+        return sum(len(message.get('content') or '') + self.MESSAGE_OVERHEAD for message in messages)
@@ -3,7 +3,14 @@ import json
 import time
 import logging
 import sqlite3
-from threading import Lock
+from contextlib import ExitStack, contextmanager, nullcontext
+from queue import LifoQueue, Empty
+from threading import Lock, Thread
+
+from write_queue import WriteBehindQueue
+from conversation_cache import ConversationCache
+from payload_codec import PayloadCodec
+from artifact_store import ArtifactStore
 
 # Configure logging
 logging.basicConfig(
@@ -13,17 +20,81 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class Database:
-    def __init__(self, db_path=None):
+    # Per-connection tuning applied to the writer and every reader
+    CONNECTION_PRAGMAS = {
+        'foreign_keys': 'ON',
+        'synchronous': 'NORMAL',  # Safe with WAL; skips the fsync on every commit
+        'cache_size': -16000,  # 16 MB page cache
+        'mmap_size': 256 * 1024 * 1024,
+        'temp_store': 'MEMORY',
+        'busy_timeout': 5000
+    }
+    
+    # synchronous pragma and whether writes go through the write-behind queue
+    DURABILITY_MODES = {
+        'strict': ('FULL', False),  # Every write is committed and fsynced before returning
+        'normal': ('NORMAL', False),  # Every write is committed before returning
+        'write_behind': ('NORMAL', True)  # Writes are group-committed a few ms later
+    }
+    
+    # Compression used for the data column of each table. Conversation rows
+    # only hold a few fields once messages live in their own table.
+    PAYLOAD_COMPRESSION = {
+        'conversations': 'none',
+        'model_metadata': 'zlib',
+        'training_metadata': 'zlib',
+        'sync_metadata': 'zstd'
+    }
+    
+    def __init__(self, db_path=None, max_read_connections=8, cache_size=256, artifacts_dir=None):
         """
         Initialize the database service.
         
         Args:
             db_path (str, optional): The path to the SQLite database file.
                                     If None, defaults to 'data/database/psychpal.db'.
+            max_read_connections (int): Size of the read connection pool.
+            cache_size (int): Number of decoded conversations kept in memory.
+            artifacts_dir (str, optional): Where large payloads such as synced weights are
+                                           stored. Defaults to 'artifacts' next to the
+                                           database directory.
         """
         self.db_path = db_path or os.path.join('data', 'database', 'psychpal.db')
         self.connection = None
-        self.lock = Lock()  # Thread safety lock
+        self.lock = Lock()  # Serializes writers; readers use the pool below
+        
+        # Pool of read-only connections shared by request threads
+        self.max_read_connections = max_read_connections
+        self._read_pool = LifoQueue()
+        self._read_connections = []
+        self._pool_lock = Lock()
+        
+        # Codecs for the data columns; decode() also reads rows written as plain JSON
+        self.codecs = {
+            table: PayloadCodec(compression) for table, compression in self.PAYLOAD_COMPRESSION.items()
+        }
+        
+        # Content-addressed files for payloads too large to keep in rows
+        self.artifacts = ArtifactStore(
+            artifacts_dir or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(self.db_path))), 'artifacts')
+        )
+        
+        # Recently used conversations, kept in sync by the write methods
+        self.conversation_cache = ConversationCache(max_entries=cache_size)
+        
+        # Write-behind queue, only set in 'write_behind' durability mode
+        self.durability_mode = 'normal'
+        self.write_queue = None
+        
+        # Queued writes that were dropped after failing to apply
+        self.write_failures = {
+            'count': 0,
+            'last_error': None,
+            'last_failure_time': None
+        }
+        
+        # Set by initialize() when SQLite was built with FTS5
+        self.fts_enabled = False
         
         # Ensure the database directory exists
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
@@ -41,10 +112,41 @@ class Database:
                     title TEXT,
                     created_at REAL,
                     updated_at REAL,
-                    data TEXT
+                    data TEXT,
+                    storage_version INTEGER DEFAULT 0
                 )
                 ''')
                 
+                # Conversations created before the messages table existed
+                # keep their messages inside the data blob (storage_version 0)
+                self._add_column_if_missing(cursor, 'conversations', 'storage_version', 'INTEGER DEFAULT 0')
+                
+                # Covering index for listing conversations newest first
+                cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_conversations_updated_at
+                ON conversations (updated_at DESC, id DESC, title)
+                ''')
+                
+                # Create messages table (one row per chat message)
+                cursor.execute('''
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id TEXT NOT NULL,
+                    seq INTEGER NOT NULL,
+                    role TEXT,
+                    content TEXT,
+                    timestamp REAL,
+                    UNIQUE (conversation_id, seq)
+                )
+                ''')
+                
+                # Rows moved out of legacy blobs; the first full training pass
+                # already covered them, so incremental runs don't count them as new
+                self._add_column_if_missing(cursor, 'messages', 'legacy', 'INTEGER DEFAULT 0')
+                
+                # Full-text index over message content
+                self.fts_enabled = self._create_message_search_index(cursor)
+                
                 # Create model_metadata table
                 cursor.execute('''
                 CREATE TABLE IF NOT EXISTS model_metadata (
@@ -66,10 +168,16 @@ class Database:
                     num_examples INTEGER,
                     adapter_path TEXT,
                     completion_time REAL,
-                    data TEXT
+                    data TEXT,
+                    model_id TEXT,
+                    watermark INTEGER
                 )
                 ''')
                 
+                # Highest messages.id consumed by each run, for incremental training
+                self._add_column_if_missing(cursor, 'training_metadata', 'model_id', 'TEXT')
+                self._add_column_if_missing(cursor, 'training_metadata', 'watermark', 'INTEGER')
+                
                 # Create sync_metadata table
                 cursor.execute('''
                 CREATE TABLE IF NOT EXISTS sync_metadata (
@@ -79,10 +187,26 @@ class Database:
                     sync_frequency TEXT,
                     adapter_path TEXT,
                     completion_time REAL,
-                    data TEXT
+                    data TEXT,
+                    status TEXT,
+                    gradient_updates_sent INTEGER,
+                    server_updates_received INTEGER,
+                    weights_hash TEXT
                 )
                 ''')
                 
+                # Sync status is read from these columns; rows saved before they
+                # existed are filled in by the background migration
+                self._add_column_if_missing(cursor, 'sync_metadata', 'status', 'TEXT')
+                self._add_column_if_missing(cursor, 'sync_metadata', 'gradient_updates_sent', 'INTEGER')
+                self._add_column_if_missing(cursor, 'sync_metadata', 'server_updates_received', 'INTEGER')
+                self._add_column_if_missing(cursor, 'sync_metadata', 'weights_hash', 'TEXT')
+                
+                cursor.execute('''
+                CREATE INDEX IF NOT EXISTS idx_sync_metadata_completion_time
+                ON sync_metadata (completion_time DESC)
+                ''')
+                
                 # Create settings table
                 cursor.execute('''
                 CREATE TABLE IF NOT EXISTS settings (
@@ -101,16 +225,197 @@ class Database:
             raise
     
     def get_connection(self):
-        """Get a connection to the SQLite database."""
+        """Get the write connection to the SQLite database."""
         if self.connection is None:
-            self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
-            # Enable foreign keys
-            self.connection.execute("PRAGMA foreign_keys = ON")
-            # Set row factory to return rows as dictionaries
-            self.connection.row_factory = self._dict_factory
+            self.connection = self._open_connection()
+            # WAL lets readers keep working while a write is in progress
+            self.connection.execute("PRAGMA journal_mode = WAL")
         
         return self.connection
     
+    @contextmanager
+    def read_connection(self):
+        """
+        Borrow a read-only connection from the pool.
+        
+        Statements run inside the block see one consistent snapshot of the
+        database and never wait for the write lock. Writes still queued in
+        'write_behind' mode are not visible yet; call flush() first where a
+        read must see them.
+        """
+        conn = self._acquire_read_connection()
+        try:
+            conn.execute('BEGIN')
+            yield conn
+        finally:
+            conn.rollback()
+            self._read_pool.put(conn)
+    
+    def set_durability_mode(self, mode, flush_interval=0.005):
+        """
+        Choose how writes are committed.
+        
+        Args:
+            mode (str): 'strict', 'normal' or 'write_behind' (see DURABILITY_MODES).
+            flush_interval (float): Group commit window for 'write_behind' mode.
+        """
+        if mode not in self.DURABILITY_MODES:
+            raise ValueError(f"Unknown durability mode: {mode}")
+        
+        synchronous, write_behind = self.DURABILITY_MODES[mode]
+        
+        # Drain the old queue before switching so no write is reordered
+        if self.write_queue is not None and not write_behind:
+            self.write_queue.close()
+            self.write_queue = None
+        
+        with self.lock:
+            self.get_connection().execute(f"PRAGMA synchronous = {synchronous}")
+        
+        if write_behind and self.write_queue is None:
+            self.write_queue = WriteBehindQueue(
+                self._apply_writes, flush_interval=flush_interval, on_failure=self._write_failed
+            )
+        
+        self.durability_mode = mode
+        logger.info(f"Database durability mode set to {mode}")
+    
+    def flush(self):
+        """Wait until every queued write has been committed."""
+        if self.write_queue is not None:
+            self.write_queue.flush()
+    
+    def get_cache_stats(self):
+        """Get statistics for the conversation cache and the write-behind queue."""
+        return {
+            'conversation_cache': self.conversation_cache.get_stats(),
+            'write_queue': self.write_queue.get_stats() if self.write_queue is not None else None,
+            'write_failures': dict(self.write_failures),
+            'durability_mode': self.durability_mode
+        }
+    
+    def _write(self, write, conversation_id=None):
+        """
+        Run a write function in its own transaction, or queue it in write-behind mode.
+        
+        Args:
+            write (callable): Takes a cursor and issues the write statements.
+            conversation_id (str, optional): Conversation the write changes, whose cached
+                                             copy is dropped if a queued write fails.
+        """
+        if self.write_queue is not None:
+            self.write_queue.submit((write, conversation_id))
+            return
+        
+        self._apply_writes([(write, conversation_id)])
+    
+    def _apply_writes(self, writes):
+        """Apply a batch of (write function, conversation ID) pairs in a single transaction."""
+        with self.lock, self.get_connection() as conn:
+            cursor = conn.cursor()
+            for write, _ in writes:
+                write(cursor)
+            conn.commit()
+    
+    def _write_failed(self, operation, error):
+        """Record a queued write that was dropped, so the cache doesn't serve data SQLite lacks."""
+        _, conversation_id = operation
+        
+        self.write_failures['count'] += 1
+        self.write_failures['last_error'] = str(error)
+        self.write_failures['last_failure_time'] = time.time()
+        
+        if conversation_id:
+            self.conversation_cache.invalidate(conversation_id)
+            logger.error(f"Write to conversation {conversation_id} was lost; dropped it from the cache")
+    
+    def _acquire_read_connection(self):
+        """Take an idle read connection, opening a new one while the pool has room."""
+        try:
+            return self._read_pool.get_nowait()
+        except Empty:
+            pass
+        
+        with self._pool_lock:
+            can_open = len(self._read_connections) < self.max_read_connections
+            if can_open:
+                conn = self._open_connection(read_only=True)
+                self._read_connections.append(conn)
+        
+        if can_open:
+            return conn
+        
+        # Pool exhausted: wait for another thread to return a connection
+        return self._read_pool.get()
+    
+    def _open_connection(self, read_only=False):
+        """Open a tuned connection to the database file."""
+        # Connections are handed between request threads but only used by one at a time
+        conn = sqlite3.connect(self.db_path, check_same_thread=False)
+        for pragma, value in self.CONNECTION_PRAGMAS.items():
+            conn.execute(f"PRAGMA {pragma} = {value}")
+        if read_only:
+            conn.execute("PRAGMA query_only = ON")
+        # Set row factory to return rows as dictionaries
+        conn.row_factory = self._dict_factory
+        return conn
+    
+    def _create_message_search_index(self, cursor):
+        """
+        Create the FTS5 index over message content and the triggers that keep it in sync.
+        
+        Returns:
+            bool: False if this SQLite build has no FTS5 support.
+        """
+        cursor.execute('''
+        SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'messages_fts'
+        ''')
+        exists = cursor.fetchone() is not None
+        
+        try:
+            # External content table: the text itself is only stored in messages
+            cursor.execute('''
+            CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+                content,
+                content='messages',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
+            )
+            ''')
+        except sqlite3.OperationalError as e:
+            logger.warning(f"Full-text search disabled: {str(e)}")
+            return False
+        
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+        END
+        ''')
+        cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF content ON messages BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, content) VALUES ('delete', old.id, old.content);
+            INSERT INTO messages_fts (rowid, content) VALUES (new.id, new.content);
+        END
+        ''')
+        
+        if not exists:
+            # Index messages written before search existed
+            cursor.execute("INSERT INTO messages_fts (messages_fts) VALUES ('rebuild')")
+        
+        return True
+    
+    def _add_column_if_missing(self, cursor, table, column, definition):
+        """Add a column to an existing table if it is not there yet."""
+        cursor.execute(f'PRAGMA table_info({table})')
+        columns = [row['name'] for row in cursor.fetchall()]
+        if column not in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {column} {definition}')
+    
     def _dict_factory(self, cursor, row):
         """Convert SQLite row objects to dictionaries."""
         d = {}
@@ -120,7 +425,10 @@ class Database:
     
     def save_conversation(self, conversation):
         """
-        Save a conversation to the database.
+        Save a conversation to the database, replacing any stored messages.
+        
+        Prefer append_messages() for adding turns to an existing conversation;
+        this method rewrites every message row of the conversation.
         
         Args:
             conversation (dict): The conversation to save.
@@ -138,19 +446,22 @@ class Database:
             created_at = conversation.get('createdAt', time.time())
             updated_at = time.time()
             
-            # Serialize the entire conversation object
-            conversation_json = json.dumps(conversation)
+            # Messages are stored as rows, everything else stays in the data column
+            messages = self._normalize_messages(conversation.get('messages', []))
+            fields = self._conversation_fields(conversation)
+            conversation_json = self.codecs['conversations'].encode(fields)
             
-            with self.lock, self.get_connection() as conn:
-                cursor = conn.cursor()
-                
+            def write(cursor):
                 # Insert or update the conversation
                 cursor.execute('''
-                INSERT OR REPLACE INTO conversations (id, title, created_at, updated_at, data)
-                VALUES (?, ?, ?, ?, ?)
+                INSERT OR REPLACE INTO conversations (id, title, created_at, updated_at, data, storage_version)
+                VALUES (?, ?, ?, ?, ?, 1)
                 ''', (conversation_id, title, created_at, updated_at, conversation_json))
                 
-                conn.commit()
+                self._rewrite_messages(cursor, conversation_id, messages)
+            
+            self._write(write, conversation_id)
+            self.conversation_cache.put(dict(fields, messages=messages))
             
             logger.info(f"Saved conversation {conversation_id}")
             return True
@@ -159,6 +470,65 @@ class Database:
             logger.error(f"Error saving conversation: {str(e)}")
             raise
     
+    def append_messages(self, conversation_id, messages, title=None):
+        """
+        Append messages to a conversation, creating the conversation if needed.
+        
+        Only the new message rows are written, so the cost of a chat turn does
+        not depend on the length of the conversation.
+        
+        Args:
+            conversation_id (str): The ID of the conversation.
+            messages (list): The messages to append, in order.
+            title (str, optional): Title to use if the conversation is new.
+        
+        Returns:
+            bool: True if successful.
+        """
+        try:
+            if not conversation_id:
+                raise ValueError("Conversation must have an 'id' field")
+            
+            now = time.time()
+            messages = self._normalize_messages(messages)
+            
+            def write(cursor):
+                cursor.execute('''
+                SELECT storage_version FROM conversations WHERE id = ?
+                ''', (conversation_id,))
+                result = cursor.fetchone()
+                
+                if result is None:
+                    cursor.execute('''
+                    INSERT INTO conversations (id, title, created_at, updated_at, data, storage_version)
+                    VALUES (?, ?, ?, ?, ?, 1)
+                    ''', (conversation_id, title or 'Conversation', now, now, self.codecs['conversations'].encode({'id': conversation_id})))
+                else:
+                    if result['storage_version'] == 0:
+                        # Not reached by the background migration yet
+                        self._migrate_conversation(cursor, conversation_id)
+                    
+                    cursor.execute('''
+                    UPDATE conversations SET updated_at = ? WHERE id = ?
+                    ''', (now, conversation_id))
+                
+                cursor.execute('''
+                SELECT COALESCE(MAX(seq), -1) + 1 AS next_seq FROM messages WHERE conversation_id = ?
+                ''', (conversation_id,))
+                next_seq = cursor.fetchone()['next_seq']
+                
+                self._insert_messages(cursor, conversation_id, messages, start_seq=next_seq)
+            
+            self._write(write, conversation_id)
+            self.conversation_cache.append(conversation_id, messages)
+            
+            logger.info(f"Appended {len(messages)} messages to conversation {conversation_id}")
+            return True
+        
+        except Exception as e:
+            logger.error(f"Error appending messages to conversation {conversation_id}: {str(e)}")
+            raise
+    
     def get_conversation(self, conversation_id):
         """
         Get a conversation by ID.
@@ -173,20 +543,41 @@ class Database:
             if not conversation_id:
                 return None
             
-            with self.lock, self.get_connection() as conn:
+            conversation = self.conversation_cache.get(conversation_id)
+            if conversation is not None:
+                return conversation
+            
+            # The conversation may have queued writes that the cache no longer holds
+            self.flush()
+            
+            token = self.conversation_cache.load_token()
+            
+            with self.read_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
-                SELECT data FROM conversations WHERE id = ?
+                SELECT data, storage_version FROM conversations WHERE id = ?
                 ''', (conversation_id,))
                 
                 result = cursor.fetchone()
+                
+                if not result or 'data' not in result:
+                    return None
+                
+                if result['storage_version'] == 0:
+                    conversation = self.codecs['conversations'].decode(result['data'])
+                else:
+                    cursor.execute('''
+                    SELECT role, content, timestamp FROM messages
+                    WHERE conversation_id = ?
+                    ORDER BY seq
+                    ''', (conversation_id,))
+                    
+                    conversation = self.codecs['conversations'].decode(result['data']) or {'id': conversation_id}
+                    conversation['messages'] = cursor.fetchall()
             
-            if result and 'data' in result:
-                conversation = json.loads(result['data'])
-                return conversation
-            
-            return None
+            self.conversation_cache.put(conversation, token=token)
+            return conversation
             
         except Exception as e:
             logger.error(f"Error getting conversation {conversation_id}: {str(e)}")
@@ -206,14 +597,17 @@ class Database:
             if not conversation_id:
                 return False
             
-            with self.lock, self.get_connection() as conn:
-                cursor = conn.cursor()
-                
+            def write(cursor):
                 cursor.execute('''
                 DELETE FROM conversations WHERE id = ?
                 ''', (conversation_id,))
                 
-                conn.commit()
+                cursor.execute('''
+                DELETE FROM messages WHERE conversation_id = ?
+                ''', (conversation_id,))
+            
+            self._write(write, conversation_id)
+            self.conversation_cache.invalidate(conversation_id)
             
             logger.info(f"Deleted conversation {conversation_id}")
             return True
@@ -230,20 +624,34 @@ class Database:
             list: A list of all conversations.
         """
         try:
-            with self.lock, self.get_connection() as conn:
+            with self.read_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
-                SELECT data FROM conversations ORDER BY updated_at DESC
+                SELECT id, data, storage_version FROM conversations ORDER BY updated_at DESC
                 ''')
                 
                 results = cursor.fetchall()
+                
+                cursor.execute('''
+                SELECT conversation_id, role, content, timestamp FROM messages
+                ORDER BY conversation_id, seq
+                ''')
+                
+                messages_by_conversation = {}
+                for row in cursor.fetchall():
+                    conversation_id = row.pop('conversation_id')
+                    messages_by_conversation.setdefault(conversation_id, []).append(row)
             
             conversations = []
             for result in results:
-                if 'data' in result:
-                    conversation = json.loads(result['data'])
-                    conversations.append(conversation)
+                if result['storage_version'] == 0:
+                    conversations.append(self.codecs['conversations'].decode(result['data']))
+                    continue
+                
+                conversation = self.codecs['conversations'].decode(result['data']) or {'id': result['id']}
+                conversation['messages'] = messages_by_conversation.get(result['id'], [])
+                conversations.append(conversation)
             
             return conversations
             
@@ -251,6 +659,496 @@ class Database:
             logger.error(f"Error getting all conversations: {str(e)}")
             return []
     
+    def iter_training_pairs(self, batch_size=500, after_id=None, until_id=None, replay_fraction=0.0):
+        """
+        Stream (user, assistant) message pairs for training.
+        
+        Pairs are matched inside SQLite and read a batch at a time, each batch
+        in its own short read, so memory stays bounded and the first pair is
+        available immediately regardless of how much history there is. A full
+        pass while legacy blobs remain reads everything from one snapshot
+        instead, so a conversation the background migration moves meanwhile
+        is seen exactly once: either as rows or as its blob.
+        
+        Args:
+            batch_size (int): Number of pairs fetched per query.
+            after_id (int, optional): Only pairs whose reply is newer than this message
+                                      ID (a training watermark); None for all pairs.
+                                      Rows moved out of legacy blobs never count as newer.
+            until_id (int, optional): Ignore replies newer than this message ID.
+            replay_fraction (float): With after_id, also replay this random
+                                     fraction of the older pairs.
+        
+        Yields:
+            dict: A training example with 'input' and 'output' keys.
+        """
+        conditions = ["u.role = 'user'", "a.role = 'assistant'"]
+        params = []
+        
+        if until_id is not None:
+            conditions.append('a.id <= ?')
+            params.append(until_id)
+        
+        # Keyset scan over reply IDs
+        last_id = 0
+        if after_id is not None and replay_fraction:
+            # New pairs, plus a Bernoulli sample of the ones trained on before
+            conditions.append('((a.id > ? AND a.legacy = 0) OR ABS(RANDOM() % 1000000) < ?)')
+            params.extend([after_id, int(replay_fraction * 1000000)])
+        elif after_id is not None:
+            # Only new pairs: start at the watermark, so the cost follows the new messages
+            last_id = after_id
+            conditions.append('a.legacy = 0')
+        
+        with ExitStack() as stack:
+            reads = self.read_connection
+            if after_id is None and self._has_unmigrated_conversations():
+                snapshot = stack.enter_context(self.read_connection())
+                reads = lambda: nullcontext(snapshot)
+            
+            yield from self._iter_pairs(reads, conditions, params, last_id, batch_size)
+            
+            # Unmigrated blobs have no message IDs, so only full passes include them
+            if after_id is None:
+                yield from self._iter_blob_pairs(reads)
+    
+    def _iter_pairs(self, reads, conditions, params, last_id, batch_size):
+        """Keyset scan of the message pairs for iter_training_pairs()."""
+        while True:
+            with reads() as conn:
+                cursor = conn.cursor()
+                
+                # An assistant reply immediately preceded by a user message
+                cursor.execute(f'''
+                SELECT a.id AS id, u.content AS input, a.content AS output
+                FROM messages a
+                JOIN messages u ON u.conversation_id = a.conversation_id AND u.seq = a.seq - 1
+                WHERE a.id > ? AND {' AND '.join(conditions)}
+                ORDER BY a.id
+                LIMIT ?
+                ''', [last_id] + params + [batch_size])
+                
+                rows = cursor.fetchall()
+            
+            if not rows:
+                break
+            
+            for row in rows:
+                yield {'input': row['input'] or '', 'output': row['output'] or ''}
+            
+            last_id = rows[-1]['id']
+    
+    def _iter_blob_pairs(self, reads):
+        """Pairs of the conversations the background migration hasn't reached yet."""
+        with reads() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT data FROM conversations WHERE storage_version = 0
+            ''')
+            
+            while True:
+                rows = cursor.fetchmany(50)
+                if not rows:
+                    break
+                
+                for row in rows:
+                    messages = (self.codecs['conversations'].decode(row['data']) or {}).get('messages', [])
+                    for current, following in zip(messages, messages[1:]):
+                        if current.get('role') == 'user' and following.get('role') == 'assistant':
+                            yield {'input': current.get('content', ''), 'output': following.get('content', '')}
+    
+    def _has_unmigrated_conversations(self):
+        """Check if any conversation still keeps its messages in a legacy blob."""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT 1 FROM conversations WHERE storage_version = 0 LIMIT 1')
+            return cursor.fetchone() is not None
+    
+    def list_conversation_summaries(self, limit=50, after_cursor=None):
+        """
+        List conversations newest first without loading their messages.
+        
+        Uses keyset pagination over (updated_at, id), so each page is an
+        index range scan no matter how deep into the history it is.
+        
+        Args:
+            limit (int): Maximum number of summaries to return.
+            after_cursor (str, optional): The next_cursor of the previous page.
+        
+        Returns:
+            dict: The summaries and the cursor for the next page (None on the last page).
+        """
+        params = []
+        where = ''
+        if after_cursor:
+            updated_at, conversation_id = self._decode_cursor(after_cursor)
+            where = 'WHERE (updated_at, id) < (?, ?)'
+            params.extend([updated_at, conversation_id])
+        
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                # Fetch one extra row to find out whether another page exists
+                cursor.execute(f'''
+                SELECT id, title, updated_at FROM conversations
+                {where}
+                ORDER BY updated_at DESC, id DESC
+                LIMIT ?
+                ''', params + [limit + 1])
+                
+                summaries = cursor.fetchall()
+            
+            next_cursor = None
+            if len(summaries) > limit:
+                summaries = summaries[:limit]
+                last = summaries[-1]
+                next_cursor = self._encode_cursor(last['updated_at'], last['id'])
+            
+            return {
+                'conversations': summaries,
+                'next_cursor': next_cursor
+            }
+        
+        except Exception as e:
+            logger.error(f"Error listing conversation summaries: {str(e)}")
+            return {
+                'conversations': [],
+                'next_cursor': None
+            }
+    
+    def search_messages(self, query, limit=20):
+        """
+        Full-text search over the content of all stored messages.
+        
+        Without FTS5 support, or while its index can't be read, messages are
+        matched with a slower LIKE scan instead, newest first.
+        
+        Args:
+            query (str): The words to search for.
+            limit (int): Maximum number of results to return.
+        
+        Returns:
+            list: Matching messages, best match first, each with a highlighted snippet.
+        """
+        match = self._fts_query(query)
+        if not match:
+            return []
+        
+        if not self.fts_enabled:
+            return self._search_messages_like(query, limit)
+        
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                SELECT m.conversation_id, m.seq, m.role, m.timestamp, c.title,
+                       snippet(messages_fts, 0, '[', ']', '...', 12) AS snippet,
+                       messages_fts.rank AS score
+                FROM messages_fts
+                JOIN messages m ON m.id = messages_fts.rowid
+                JOIN conversations c ON c.id = m.conversation_id
+                WHERE messages_fts MATCH ?
+                ORDER BY messages_fts.rank
+                LIMIT ?
+                ''', (match, limit))
+                
+                return cursor.fetchall()
+        
+        except sqlite3.OperationalError as e:
+            # e.g. the index table is missing or this SQLite build can't read it
+            logger.warning(f"Full-text search failed, scanning messages instead: {str(e)}")
+            return self._search_messages_like(query, limit)
+        
+        except Exception as e:
+            logger.error(f"Error searching messages: {str(e)}")
+            return []
+    
+    def _search_messages_like(self, query, limit):
+        """Search messages containing every word of the query with LIKE, newest first."""
+        words = [word.replace('"', '') for word in query.split()]
+        words = [word for word in words if word]
+        
+        # Escape LIKE wildcards so they match literally
+        patterns = [
+            '%' + word.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%'
+            for word in words
+        ]
+        conditions = ' AND '.join("m.content LIKE ? ESCAPE '\\'" for _ in patterns)
+        
+        try:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute(f'''
+                SELECT m.conversation_id, m.seq, m.role, m.timestamp, c.title, m.content
+                FROM messages m
+                JOIN conversations c ON c.id = m.conversation_id
+                WHERE {conditions}
+                ORDER BY m.id DESC
+                LIMIT ?
+                ''', patterns + [limit])
+                
+                rows = cursor.fetchall()
+        
+        except Exception as e:
+            logger.error(f"Error searching messages: {str(e)}")
+            return []
+        
+        for row in rows:
+            row['snippet'] = self._like_snippet(row.pop('content') or '', words)
+            row['score'] = None
+        return rows
+    
+    def _like_snippet(self, content, words, context=60):
+        """Cut a snippet around the first matched word, marked like the FTS5 snippets."""
+        lowered = content.lower()
+        positions = [(lowered.find(word.lower()), word) for word in words]
+        positions = [(position, word) for position, word in positions if position >= 0]
+        if not positions:
+            return content[:2 * context]
+        
+        position, word = min(positions)
+        start = max(0, position - context)
+        end = min(len(content), position + len(word) + context)
+        
+        return (
+            ('...' if start > 0 else '')
+            + content[start:position] + '[' + content[position:position + len(word)] + ']'
+            + content[position + len(word):end]
+            + ('...' if end < len(content) else '')
+        )
+    
+    def _fts_query(self, query):
+        """Turn free text into an FTS5 query that matches all of its words."""
+        # Quote every word so user input can't be parsed as FTS5 syntax
+        words = [word.replace('"', '') for word in (query or '').split()]
+        return ' '.join(f'"{word}"' for word in words if word)
+    
+    def _encode_cursor(self, updated_at, conversation_id):
+        """Build an opaque pagination cursor from a conversation's sort key."""
+        return f"{updated_at!r}|{conversation_id}"
+    
+    def _decode_cursor(self, cursor):
+        """Split a pagination cursor back into (updated_at, id)."""
+        updated_at, separator, conversation_id = cursor.partition('|')
+        try:
+            if not separator:
+                raise ValueError
+            return float(updated_at), conversation_id
+        except ValueError:
+            raise ValueError(f"Invalid pagination cursor: {cursor}")
+    
+    def start_migrations(self, batch_size=50, pause=0.1):
+        """
+        Bring legacy rows up to the current storage format in a background thread.
+        
+        Messages are first moved out of legacy conversation blobs, then data
+        columns written by an older codec are re-encoded. Rows are migrated a
+        batch at a time, releasing the lock in between so chat requests are
+        never blocked for long.
+        
+        Args:
+            batch_size (int): Number of rows migrated per transaction.
+            pause (float): Seconds to wait between batches.
+        
+        Returns:
+            threading.Thread: The migration thread.
+        """
+        def migrate():
+            try:
+                self._migrate_messages(batch_size, pause)
+                self._migrate_sync_rows(batch_size, pause)
+                self._migrate_payloads(batch_size, pause)
+            except Exception as e:
+                logger.error(f"Error migrating database rows: {str(e)}")
+        
+        thread = Thread(target=migrate, daemon=True)
+        thread.start()
+        return thread
+    
+    def _migrate_messages(self, batch_size, pause):
+        """Move the messages of every legacy conversation blob into the messages table."""
+        migrated = 0
+        while True:
+            with self.lock, self.get_connection() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute('''
+                SELECT id FROM conversations WHERE storage_version = 0 LIMIT ?
+                ''', (batch_size,))
+                conversation_ids = [row['id'] for row in cursor.fetchall()]
+                
+                for conversation_id in conversation_ids:
+                    self._migrate_conversation(cursor, conversation_id)
+                
+                conn.commit()
+            
+            if not conversation_ids:
+                break
+            
+            migrated += len(conversation_ids)
+            time.sleep(pause)
+        
+        if migrated:
+            logger.info(f"Migrated {migrated} conversations to the messages table")
+    
+    def _migrate_sync_rows(self, batch_size, pause):
+        """Fill in the typed sync columns and move weights out of legacy sync rows."""
+        migrated = 0
+        while True:
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('''
+                SELECT id, data FROM sync_metadata WHERE status IS NULL LIMIT ?
+                ''', (batch_size,))
+                rows = cursor.fetchall()
+            
+            if not rows:
+                break
+            
+            # Artifacts are written outside the lock; only the row updates need it
+            updates = []
+            for row in rows:
+                metadata = self.codecs['sync_metadata'].decode(row['data']) or {}
+                metadata, status, server_updates_received, weights_hash = self._slim_sync_metadata(metadata)
+                updates.append((
+                    self.codecs['sync_metadata'].encode(metadata), status, 1,
+                    server_updates_received, weights_hash, row['id']
+                ))
+            
+            with self.lock, self.get_connection() as conn:
+                conn.executemany('''
+                UPDATE sync_metadata
+                SET data = ?, status = ?, gradient_updates_sent = ?, server_updates_received = ?, weights_hash = ?
+                WHERE id = ? AND status IS NULL
+                ''', updates)
+                conn.commit()
+            
+            migrated += len(rows)
+            time.sleep(pause)
+        
+        if migrated:
+            logger.info(f"Migrated {migrated} sync rows to typed columns")
+    
+    def _migrate_payloads(self, batch_size, pause):
+        """Re-encode data columns that were written with a different codec."""
+        # Skip the scan when the rows were already encoded with the current settings
+        if self.get_setting('payload_encoding') == self.PAYLOAD_COMPRESSION:
+            return
+        
+        for table, codec in self.codecs.items():
+            # Legacy conversation blobs are handled by the message migration
+            condition = 'AND storage_version = 1' if table == 'conversations' else ''
+            last_rowid = 0
+            recoded = 0
+            
+            while True:
+                with self.lock, self.get_connection() as conn:
+                    cursor = conn.cursor()
+                    
+                    cursor.execute(f'''
+                    SELECT rowid, data FROM {table}
+                    WHERE rowid > ? {condition}
+                    ORDER BY rowid
+                    LIMIT ?
+                    ''', (last_rowid, batch_size))
+                    rows = cursor.fetchall()
+                    
+                    for row in rows:
+                        encoded = codec.encode(codec.decode(row['data']))
+                        if encoded != row['data']:
+                            cursor.execute(f'''
+                            UPDATE {table} SET data = ? WHERE rowid = ?
+                            ''', (encoded, row['rowid']))
+                            recoded += 1
+                    
+                    conn.commit()
+                
+                if not rows:
+                    break
+                
+                last_rowid = rows[-1]['rowid']
+                time.sleep(pause)
+            
+            if recoded:
+                logger.info(f"Re-encoded {recoded} rows of {table}")
+        
+        self.save_setting('payload_encoding', self.PAYLOAD_COMPRESSION)
+    
+    def _migrate_conversation(self, cursor, conversation_id):
+        """Move the messages of one legacy conversation blob into the messages table."""
+        cursor.execute('''
+        SELECT data FROM conversations WHERE id = ? AND storage_version = 0
+        ''', (conversation_id,))
+        result = cursor.fetchone()
+        if not result:
+            return
+        
+        conversation = self.codecs['conversations'].decode(result['data']) or {}
+        
+        self._rewrite_messages(cursor, conversation_id, self._normalize_messages(conversation.get('messages', [])), legacy=True)
+        
+        cursor.execute('''
+        UPDATE conversations SET data = ?, storage_version = 1 WHERE id = ?
+        ''', (self.codecs['conversations'].encode(self._conversation_fields(conversation)), conversation_id))
+    
+    def _rewrite_messages(self, cursor, conversation_id, messages, legacy=False):
+        """
+        Replace the message rows of a conversation.
+        
+        Rows are updated in place, so messages keep their IDs and stay below
+        the training watermark they were already trained under; rows past
+        the new end are deleted.
+        
+        Args:
+            cursor: Cursor of the write transaction.
+            conversation_id (str): The ID of the conversation.
+            messages (list): The normalized messages, in order.
+            legacy (bool): Mark newly inserted rows as moved out of a legacy blob.
+        """
+        cursor.executemany('''
+        INSERT INTO messages (conversation_id, seq, role, content, timestamp, legacy)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ON CONFLICT (conversation_id, seq) DO UPDATE SET
+            role = excluded.role,
+            content = excluded.content,
+            timestamp = excluded.timestamp
+        ''', [
+            (conversation_id, seq, message['role'], message['content'], message['timestamp'], int(legacy))
+            for seq, message in enumerate(messages)
+        ])
+        
+        cursor.execute('''
+        DELETE FROM messages WHERE conversation_id = ? AND seq >= ?
+        ''', (conversation_id, len(messages)))
+    
+    def _insert_messages(self, cursor, conversation_id, messages, start_seq):
+        """Insert message rows for a conversation starting at the given sequence number."""
+        cursor.executemany('''
+        INSERT INTO messages (conversation_id, seq, role, content, timestamp)
+        VALUES (?, ?, ?, ?, ?)
+        ''', [
+            (conversation_id, start_seq + i, message['role'], message['content'], message['timestamp'])
+            for i, message in enumerate(messages)
+        ])
+    
+    def _normalize_messages(self, messages):
+        """Reduce messages to the stored fields, filling in defaults."""
+        return [
+            {
+                'role': message.get('role', 'user'),
+                'content': message.get('content', ''),
+                'timestamp': message.get('timestamp', time.time())
+            }
+            for message in messages
+        ]
+    
+    def _conversation_fields(self, conversation):
+        """Return the conversation without its messages, for the data column."""
+        return {key: value for key, value in conversation.items() if key != 'messages'}
+    
     def save_model_metadata(self, metadata):
         """
         Save model metadata to the database.
@@ -270,18 +1168,16 @@ class Database:
             path = metadata.get('path', '')
             download_time = metadata.get('download_time', time.time())
             
-            # Serialize the entire metadata object
-            metadata_json = json.dumps(metadata)
+            # Encode the entire metadata object
+            encoded_metadata = self.codecs['model_metadata'].encode(metadata)
             
-            with self.lock, self.get_connection() as conn:
-                cursor = conn.cursor()
-                
+            def write(cursor):
                 cursor.execute('''
                 INSERT OR REPLACE INTO model_metadata (id, status, path, download_time, data)
                 VALUES (?, ?, ?, ?, ?)
-                ''', (model_id, status, path, download_time, metadata_json))
-                
-                conn.commit()
+                ''', (model_id, status, path, download_time, encoded_metadata))
+            
+            self._write(write)
             
             logger.info(f"Saved model metadata for {model_id}")
             return True
@@ -298,7 +1194,7 @@ class Database:
             dict: The model metadata, or None if not found.
         """
         try:
-            with self.lock, self.get_connection() as conn:
+            with self.read_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -310,7 +1206,7 @@ class Database:
                 result = cursor.fetchone()
             
             if result and 'data' in result:
-                metadata = json.loads(result['data'])
+                metadata = self.codecs['model_metadata'].decode(result['data'])
                 return metadata
             
             return None
@@ -340,20 +1236,21 @@ class Database:
             num_examples = metadata.get('num_examples', 0)
             adapter_path = metadata.get('adapter_path', '')
             completion_time = metadata.get('completion_time', time.time())
+            model_id = metadata.get('model_id')
+            watermark = metadata.get('watermark')
             
-            # Serialize the entire metadata object
-            metadata_json = json.dumps(metadata)
+            # Encode the entire metadata object
+            encoded_metadata = self.codecs['training_metadata'].encode(metadata)
             
-            with self.lock, self.get_connection() as conn:
-                cursor = conn.cursor()
-                
+            def write(cursor):
                 cursor.execute('''
                 INSERT OR REPLACE INTO training_metadata 
-                (id, epochs, batch_size, learning_rate, num_examples, adapter_path, completion_time, data)
-                VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                ''', (training_id, epochs, batch_size, learning_rate, num_examples, adapter_path, completion_time, metadata_json))
-                
-                conn.commit()
+                (id, epochs, batch_size, learning_rate, num_examples, adapter_path, completion_time, data, model_id, watermark)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (training_id, epochs, batch_size, learning_rate, num_examples, adapter_path, completion_time, encoded_metadata,
+                      model_id, watermark))
+            
+            self._write(write)
             
             logger.info(f"Saved training metadata for {training_id}")
             return True
@@ -362,6 +1259,56 @@ class Database:
             logger.error(f"Error saving training metadata: {str(e)}")
             raise
     
+    def get_training_watermark(self, model_id=None):
+        """
+        Get the highest message ID already used to train a model.
+        
+        Args:
+            model_id (str, optional): Only consider runs for this model.
+        
+        Returns:
+            int: The watermark, or None if no run recorded one.
+        """
+        try:
+            # A run that just finished may still have its watermark queued
+            self.flush()
+            
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                
+                if model_id:
+                    cursor.execute('''
+                    SELECT MAX(watermark) AS watermark FROM training_metadata WHERE model_id = ?
+                    ''', (model_id,))
+                else:
+                    cursor.execute('SELECT MAX(watermark) AS watermark FROM training_metadata')
+                
+                return cursor.fetchone()['watermark']
+        
+        except Exception as e:
+            logger.error(f"Error getting training watermark: {str(e)}")
+            return None
+    
+    def get_message_watermark(self):
+        """
+        Get the ID of the newest stored message.
+        
+        Returns:
+            int: The watermark, 0 if there are no messages, or None if it couldn't be read.
+        """
+        try:
+            # Training snapshots start from every write made so far, including queued ones
+            self.flush()
+            
+            with self.read_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute('SELECT COALESCE(MAX(id), 0) AS watermark FROM messages')
+                return cursor.fetchone()['watermark']
+        
+        except Exception as e:
+            logger.error(f"Error getting message watermark: {str(e)}")
+            return None
+    
     def get_training_stats(self):
         """
         Get training statistics from the database.
@@ -370,7 +1317,7 @@ class Database:
             dict: Training statistics.
         """
         try:
-            with self.lock, self.get_connection() as conn:
+            with self.read_connection() as conn:
                 cursor = conn.cursor()
                 
                 # Get total number of training sessions
@@ -393,7 +1340,7 @@ class Database:
                 model_loss = None
                 
                 if latest_result and 'data' in latest_result:
-                    latest_metadata = json.loads(latest_result['data'])
+                    latest_metadata = self.codecs['training_metadata'].decode(latest_result['data'])
                     # If this metadata included performance metrics, we would extract them here
                 
                 stats = {
@@ -439,19 +1386,23 @@ class Database:
             adapter_path = metadata.get('adapter_path', '')
             completion_time = metadata.get('completion_time', time.time())
             
-            # Serialize the entire metadata object
-            metadata_json = json.dumps(metadata)
+            # Weights go to the artifact store; the row only keeps their hash
+            metadata, status, server_updates_received, weights_hash = self._slim_sync_metadata(metadata)
+            gradient_updates_sent = metadata.get('gradient_updates_sent', 1)
             
-            with self.lock, self.get_connection() as conn:
-                cursor = conn.cursor()
-                
+            # Encode the remaining metadata object
+            encoded_metadata = self.codecs['sync_metadata'].encode(metadata)
+            
+            def write(cursor):
                 cursor.execute('''
                 INSERT OR REPLACE INTO sync_metadata 
-                (id, privacy_epsilon, privacy_delta, sync_frequency, adapter_path, completion_time, data)
-                VALUES (?, ?, ?, ?, ?, ?, ?)
-                ''', (sync_id, privacy_epsilon, privacy_delta, sync_frequency, adapter_path, completion_time, metadata_json))
-                
-                conn.commit()
+                (id, privacy_epsilon, privacy_delta, sync_frequency, adapter_path, completion_time, data,
+                 status, gradient_updates_sent, server_updates_received, weights_hash)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ''', (sync_id, privacy_epsilon, privacy_delta, sync_frequency, adapter_path, completion_time, encoded_metadata,
+                      status, gradient_updates_sent, server_updates_received, weights_hash))
+            
+            self._write(write)
             
             logger.info(f"Saved sync metadata for {sync_id}")
             return True
@@ -460,6 +1411,52 @@ class Database:
             logger.error(f"Error saving sync metadata: {str(e)}")
             raise
     
+    def _slim_sync_metadata(self, metadata):
+        """
+        Split sync metadata into a slim row and a weights artifact.
+        
+        Returns:
+            tuple: (metadata without weights, status, server_updates_received, weights_hash)
+        """
+        metadata = dict(metadata)
+        server_response = dict(metadata.get('server_response') or {})
+        weights_hash = metadata.get('weights_hash')
+        
+        updated_weights = server_response.pop('updated_weights', None)
+        if updated_weights is not None:
+            weights_hash = self.artifacts.put(updated_weights)
+        
+        if weights_hash:
+            metadata['weights_hash'] = weights_hash
+        metadata['server_response'] = server_response
+        
+        status = server_response.get('status') or metadata.get('status') or 'unknown'
+        server_updates_received = 1 if weights_hash else 0
+        
+        return metadata, status, server_updates_received, weights_hash
+    
+    def get_sync_weights(self, sync_id):
+        """
+        Load the weights the server returned for a sync.
+        
+        Args:
+            sync_id (str): The ID of the sync.
+        
+        Returns:
+            dict: The weights, or None if the sync returned none.
+        """
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT weights_hash FROM sync_metadata WHERE id = ?
+            ''', (sync_id,))
+            result = cursor.fetchone()
+        
+        if not result or not result['weights_hash']:
+            return None
+        
+        return self.artifacts.get(result['weights_hash'])
+    
     def get_latest_sync_status(self):
         """
         Get the latest synchronization status.
@@ -468,28 +1465,29 @@ class Database:
             dict: The sync status.
         """
         try:
-            with self.lock, self.get_connection() as conn:
+            with self.read_connection() as conn:
                 cursor = conn.cursor()
                 
+                # Typed columns only, so the cost doesn't depend on the payload size
                 cursor.execute('''
-                SELECT data FROM sync_metadata 
+                SELECT completion_time, status, gradient_updates_sent, server_updates_received
+                FROM sync_metadata 
                 ORDER BY completion_time DESC 
                 LIMIT 1
                 ''')
                 
                 result = cursor.fetchone()
             
-            if result and 'data' in result:
-                sync_metadata = json.loads(result['data'])
-                
-                # Extract the server response from the metadata
-                server_response = sync_metadata.get('server_response', {})
+            if result:
+                if result['status'] is None:
+                    # Saved before the typed columns existed and not migrated yet
+                    return self._legacy_sync_status()
                 
                 return {
-                    'last_sync_time': sync_metadata.get('completion_time'),
-                    'sync_successful': server_response.get('status') == 'success',
-                    'gradient_updates_sent': 1,  # In a real implementation, this would be tracked
-                    'server_updates_received': 1 if 'updated_weights' in server_response else 0
+                    'last_sync_time': result['completion_time'],
+                    'sync_successful': result['status'] == 'success',
+                    'gradient_updates_sent': result['gradient_updates_sent'] or 0,
+                    'server_updates_received': result['server_updates_received'] or 0
                 }
             
             return {
@@ -508,6 +1506,25 @@ class Database:
                 'server_updates_received': 0
             }
     
+    def _legacy_sync_status(self):
+        """Build the sync status from the latest row's data blob."""
+        with self.read_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+            SELECT data FROM sync_metadata ORDER BY completion_time DESC LIMIT 1
+            ''')
+            result = cursor.fetchone()
+        
+        sync_metadata = self.codecs['sync_metadata'].decode(result['data'])
+        server_response = sync_metadata.get('server_response', {})
+        
+        return {
+            'last_sync_time': sync_metadata.get('completion_time'),
+            'sync_successful': server_response.get('status') == 'success',
+            'gradient_updates_sent': 1,
+            'server_updates_received': 1 if 'updated_weights' in server_response else 0
+        }
+    
     def get_sync_schedule(self):
         """
         Get the current synchronization schedule.
@@ -516,24 +1533,23 @@ class Database:
             dict: The sync schedule.
         """
         try:
-            with self.lock, self.get_connection() as conn:
+            with self.read_connection() as conn:
                 cursor = conn.cursor()
                 
-                # Get the most recent sync metadata to determine the schedule
+                # Get the most recent sync to determine the schedule
                 cursor.execute('''
-                SELECT data FROM sync_metadata 
+                SELECT sync_frequency, completion_time FROM sync_metadata 
                 ORDER BY completion_time DESC 
                 LIMIT 1
                 ''')
                 
                 result = cursor.fetchone()
             
-            if result and 'data' in result:
-                sync_metadata = json.loads(result['data'])
-                frequency = sync_metadata.get('sync_frequency', 'manual')
+            if result:
+                frequency = result['sync_frequency'] or 'manual'
                 
                 # Calculate next sync time based on frequency
-                last_sync_time = sync_metadata.get('completion_time')
+                last_sync_time = result['completion_time']
                 next_sync_time = None
                 
                 if last_sync_time:
@@ -581,15 +1597,13 @@ class Database:
             
             updated_at = time.time()
             
-            with self.lock, self.get_connection() as conn:
-                cursor = conn.cursor()
-                
+            def write(cursor):
                 cursor.execute('''
                 INSERT OR REPLACE INTO settings (key, value, updated_at)
                 VALUES (?, ?, ?)
                 ''', (key, value, updated_at))
-                
-                conn.commit()
+            
+            self._write(write)
             
             logger.info(f"Saved setting {key}")
             return True
@@ -610,7 +1624,7 @@ class Database:
             The setting value.
         """
         try:
-            with self.lock, self.get_connection() as conn:
+            with self.read_connection() as conn:
                 cursor = conn.cursor()
                 
                 cursor.execute('''
@@ -635,7 +1649,17 @@ class Database:
             return default
     
     def close(self):
-        """Close the database connection."""
+        """Flush queued writes, then close the write connection and every pooled read connection."""
+        if self.write_queue is not None:
+            self.write_queue.close()
+            self.write_queue = None
+        
+        with self._pool_lock:
+            for conn in self._read_connections:
+                conn.close()
+            self._read_connections = []
+            self._read_pool = LifoQueue()
+        
         if self.connection:
             self.connection.close()
             self.connection = None
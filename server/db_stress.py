@@ -0,0 +1,105 @@
+"""
+Stress test for the database layer under parallel Flask requests.
+
+Reader threads hammer the read-only API endpoints through Flask's test
+client while writer threads append chat turns the same way /api/chat does.
+Throughput and latency percentiles are reported for both sides, so runs
+can be compared before and after database changes.
+
+Usage:
+    python db_stress.py --readers 16 --writers 4 --duration 10
+"""
+import os
+import time
+import logging
+import uuid
+import argparse
+import tempfile
+import threading
+
+import app as server
+from database import Database
+
+READ_ENDPOINTS = ['/api/sync/status', '/api/sync/schedule', '/api/train/stats']
+
+
+def percentile(samples, pct):
+    """Return the given percentile of a list of latency samples."""
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    index = min(len(samples) - 1, int(len(samples) * pct / 100))
+    return samples[index]
+
+
+def run(readers, writers, duration, db_path):
+    database = Database(db_path)
+    database.initialize()
+    server.database = database
+    
+    conversation_ids = [str(uuid.uuid4()) for _ in range(max(writers, 1) * 4)]
+    latencies = {'read': [], 'write': []}
+    errors = []
+    stop_at = time.time() + duration
+    
+    def reader(index):
+        client = server.app.test_client()
+        samples = []
+        i = index
+        while time.time() < stop_at:
+            endpoint = READ_ENDPOINTS[i % len(READ_ENDPOINTS)]
+            started = time.perf_counter()
+            if i % 2:
+                response = client.get(endpoint)
+                if response.status_code != 200:
+                    errors.append(f"{endpoint}: {response.status_code}")
+            else:
+                database.get_conversation(conversation_ids[i % len(conversation_ids)])
+            samples.append(time.perf_counter() - started)
+            i += 1
+        latencies['read'].extend(samples)
+    
+    def writer(index):
+        samples = []
+        i = 0
+        while time.time() < stop_at:
+            conversation_id = conversation_ids[(index + i * writers) % len(conversation_ids)]
+            started = time.perf_counter()
+            database.append_messages(conversation_id, [
+                {'role': 'user', 'content': f"Stress message {i}", 'timestamp': time.time()},
+                {'role': 'assistant', 'content': f"Stress reply {i}", 'timestamp': time.time()}
+            ])
+            samples.append(time.perf_counter() - started)
+            i += 1
+        latencies['write'].extend(samples)
+    
+    threads = [threading.Thread(target=reader, args=(i,)) for i in range(readers)]
+    threads += [threading.Thread(target=writer, args=(i,)) for i in range(writers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    
+    database.close()
+    
+    for kind, samples in latencies.items():
+        print(f"{kind:>5}: {len(samples) / duration:10.1f} ops/s   "
+              f"p50 {percentile(samples, 50) * 1000:7.2f} ms   "
+              f"p99 {percentile(samples, 99) * 1000:7.2f} ms")
+    if errors:
+        print(f"{len(errors)} failed requests, first: {errors[0]}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Stress test the PsychPal database layer")
+    parser.add_argument('--readers', type=int, default=16, help="Number of reader threads")
+    parser.add_argument('--writers', type=int, default=4, help="Number of writer threads")
+    parser.add_argument('--duration', type=float, default=10.0, help="Test duration in seconds")
+    parser.add_argument('--db', default=None, help="Database path (defaults to a temporary file)")
+    args = parser.parse_args()
+    
+    # Per-request INFO logs would dominate the measurement
+    logging.getLogger().setLevel(logging.WARNING)
+    
+    db_path = args.db or os.path.join(tempfile.mkdtemp(), 'stress.db')
+    run(args.readers, args.writers, args.duration, db_path)
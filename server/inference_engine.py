@@ -0,0 +1,666 @@
+import time
+import logging
+from collections import deque
+from queue import Queue
+from threading import Condition, Event, Thread
+import torch
+from transformers import (
+    LogitsProcessorList,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper
+)
+
+from kv_cache import KVCacheStore
+from stop_sequences import StopSequenceCriteria
+from speculative import verify_draft
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class InferenceRequest:
+    def __init__(self, token_ids, conversation_id=None, max_new_tokens=100, stream=False, adapter=None):
+        """
+        A prompt waiting for, or in the middle of, generation.
+        
+        Args:
+            token_ids (list): Prompt token IDs.
+            conversation_id (str, optional): Conversation whose KV cache may be reused.
+            max_new_tokens (int): Maximum number of tokens to generate.
+            stream (bool): Whether to publish decoded text while generating.
+            adapter (str, optional): Saved adapter to generate with.
+        """
+        self.token_ids = list(token_ids)
+        self.conversation_id = conversation_id
+        self.adapter = adapter
+        self.max_new_tokens = max_new_tokens
+        self.stream_text = stream
+        
+        self.generated = []
+        self.pieces = Queue()
+        self.done = Event()
+        self.cancelled = False
+        self.error = None
+        
+        # Worker-side state
+        self.length = 0  # Tokens covered by this row's KV cache
+        self.next_token = None  # Sampled token still to be fed to the model
+        self.past_key_values = None  # Partial KV cache while the prompt is prefilled in chunks
+        self.emitted_length = 0  # Characters of decoded text already published
+        self.stop_criteria = None
+    
+    def stream(self):
+        """
+        Yield decoded text as it is generated.
+        
+        Raises the generation error, if any, once the stream ends.
+        """
+        while True:
+            piece = self.pieces.get()
+            if piece is None:
+                break
+            yield piece
+        
+        if self.error is not None:
+            raise self.error
+    
+    def result(self, timeout=None):
+        """
+        Wait for generation to finish.
+        
+        Returns:
+            list: The generated token IDs.
+        """
+        if not self.done.wait(timeout):
+            raise TimeoutError("Generation did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return list(self.generated)
+    
+    def cancel(self):
+        """Stop generating for this request at the next decode step."""
+        self.cancelled = True
+    
+    def finish(self, error=None):
+        """Mark the request as done; called by the engine."""
+        self.error = error
+        self.done.set()
+        self.pieces.put(None)
+
+class InferenceEngine:
+    def __init__(self, model_service, max_batch_size=16, prefill_chunk_size=256,
+                 temperature=0.7, top_p=0.9, top_k=50, repetition_penalty=1.2):
+        """
+        Initialize the inference engine.
+        
+        A single worker thread owns all inference on the model. It takes
+        prompts from a queue and decodes every active request together, one
+        token per step, with left-padded KV caches. Requests that arrive
+        while others are generating are prefilled and join the batch between
+        decode steps instead of waiting for the batch to finish. Prompts are
+        prefilled at most prefill_chunk_size tokens per step, shortest first,
+        so a long prompt doesn't hold up the decode steps of other requests.
+        Requests for a different adapter wait until the current batch drains.
+        A batch stays on the published version it started with; once a newer
+        version is published, new requests wait for the batch to drain and
+        then start a batch on the new version.
+        
+        Args:
+            model_service (ModelService): Provides the model, tokenizer, KV cache
+                                          store, stop sequences and model lock.
+            max_batch_size (int): Maximum number of requests decoded together.
+            prefill_chunk_size (int): Maximum prompt tokens prefilled per step.
+            temperature (float): Sampling temperature.
+            top_p (float): Nucleus sampling probability mass.
+            top_k (int): Number of most likely tokens to sample from.
+            repetition_penalty (float): Penalty for tokens already in the sequence.
+        """
+        self.model_service = model_service
+        self.max_batch_size = max_batch_size
+        self.prefill_chunk_size = prefill_chunk_size
+        
+        self.processors = LogitsProcessorList([
+            RepetitionPenaltyLogitsProcessor(repetition_penalty)
+        ])
+        self.warpers = LogitsProcessorList([
+            TemperatureLogitsWarper(temperature),
+            TopKLogitsWarper(top_k),
+            TopPLogitsWarper(top_p)
+        ])
+        
+        self.waiting = deque()
+        self.condition = Condition()
+        
+        # Batch state, only touched by the worker thread
+        self.rows = []
+        self.prefilling = []  # Admitted requests whose prompts are partly prefilled
+        self.past_key_values = None  # Per-layer (key, value), left padded to a common length
+        self.attention_mask = None  # 1 for real positions, 0 for padding
+        self.batch_model = None
+        self.batch_version = None  # Published version the batch runs on until it drains
+        self.batch_tokenizer = None
+        self.batch_adapter = None  # Every row in a batch uses the same adapter
+        
+        self.stats = {
+            'requests': 0,
+            'generated_tokens': 0,
+            'decode_steps': 0,
+            'decoded_rows': 0,
+            'prefill_chunks': 0,
+            'prefilled_tokens': 0,
+            'busy_seconds': 0.0
+        }
+        
+        # Throughput per inference precision, to compare fp32/bf16/int8
+        self.precision_stats = {}  # precision -> {'generated_tokens', 'busy_seconds'}
+        
+        self.worker = Thread(target=self._run, daemon=True)
+        self.worker.start()
+    
+    def submit(self, token_ids, conversation_id=None, max_new_tokens=100, stream=False, adapter=None):
+        """
+        Queue a prompt for generation.
+        
+        Returns:
+            InferenceRequest: Use result() or stream() to get the output.
+        """
+        request = InferenceRequest(token_ids, conversation_id, max_new_tokens, stream, adapter)
+        
+        with self.condition:
+            self.waiting.append(request)
+            self.condition.notify_all()
+        
+        return request
+    
+    def get_stats(self):
+        """Get throughput and batching statistics."""
+        with self.condition:
+            stats = dict(self.stats)
+            stats['waiting'] = len(self.waiting)
+            stats['tokens_per_second_by_precision'] = {
+                precision: entry['generated_tokens'] / entry['busy_seconds'] if entry['busy_seconds'] else 0
+                for precision, entry in self.precision_stats.items()
+            }
+        
+        stats['active'] = len(self.rows)
+        stats['prefilling'] = len(self.prefilling)
+        stats['average_generated_tokens'] = (
+            stats['generated_tokens'] / stats['requests'] if stats['requests'] else 0
+        )
+        stats['average_batch_size'] = (
+            stats['decoded_rows'] / stats['decode_steps'] if stats['decode_steps'] else 0
+        )
+        stats['tokens_per_second'] = (
+            stats['generated_tokens'] / stats['busy_seconds'] if stats['busy_seconds'] else 0
+        )
+        return stats
+    
+    def _run(self):
+        """Worker loop: admit and prefill waiting requests, then advance the batch by one token."""
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.waiting or self.rows or self.prefilling)
+            
+            started = time.time()
+            generated_before = self.stats['generated_tokens']
+            try:
+                # Loading a new model takes the same lock, so a batch never starts on
+                # a half-swapped model and tokenizer; published versions swap without it
+                with self.model_service.model_lock:
+                    self._step()
+            except Exception as e:
+                logger.error(f"Error in inference step: {str(e)}")
+                self._fail_all(e)
+            
+            version = self.batch_version
+            precision = version.precision if version is not None else None
+            
+            with self.condition:
+                elapsed = time.time() - started
+                self.stats['busy_seconds'] += elapsed
+                
+                entry = self.precision_stats.setdefault(precision, {'generated_tokens': 0, 'busy_seconds': 0.0})
+                entry['generated_tokens'] += self.stats['generated_tokens'] - generated_before
+                entry['busy_seconds'] += elapsed
+    
+    def _step(self):
+        """Run one scheduling step."""
+        if not self.rows and not self.prefilling and not self._start_batch():
+            return
+        
+        model = self.batch_model
+        
+        self._admit()
+        self._prefill_chunks(model)
+        if not self.rows:
+            return
+        
+        # Drafting only pays off when a single request has the model to itself
+        draft = self.model_service.draft_model
+        lookup = self.model_service.prompt_lookup
+        with self.condition:
+            solo = len(self.rows) == 1 and not self.waiting and not self.prefilling
+        
+        if solo and (draft is not None or lookup is not None):
+            self._speculative_decode(model, draft, lookup)
+        else:
+            self._decode(model)
+    
+    def _start_batch(self):
+        """
+        Start the next batch on the latest published version, with the adapter
+        of the oldest waiting request.
+        
+        Returns:
+            bool: Whether a batch was started.
+        """
+        with self.condition:
+            if not self.waiting:
+                return False
+            self.batch_adapter = self.waiting[0].adapter
+        
+        version = self.model_service.published
+        try:
+            model = self.model_service.get_serving_model(self.batch_adapter, version)
+        except Exception as e:
+            # A request for an adapter that can't be loaded fails on its own
+            logger.error(f"Error loading adapter {self.batch_adapter}: {str(e)}")
+            with self.condition:
+                request = self.waiting.popleft()
+            request.finish(e)
+            return False
+        
+        if model is None:
+            self._fail_all(ValueError("No model is loaded"))
+            return False
+        
+        self.batch_model = model
+        self.batch_version = version
+        self.batch_tokenizer = self.model_service.tokenizer
+        if model.training:
+            model.eval()
+        return True
+    
+    def _admit(self):
+        """Take waiting requests into free batch slots and look up their cached prefixes."""
+        while len(self.rows) + len(self.prefilling) < self.max_batch_size:
+            with self.condition:
+                # Keep arrival order: stop at the first request for another adapter
+                if not self.waiting or self.waiting[0].adapter != self.batch_adapter:
+                    return
+                
+                # Every reply comes from one version, so a stale batch only drains
+                if self.model_service.published is not self.batch_version:
+                    return
+                request = self.waiting.popleft()
+            
+            if request.cancelled:
+                request.finish()
+                continue
+            
+            if request.stop_criteria is None:
+                with self.condition:
+                    self.stats['requests'] += 1
+                request.stop_criteria = StopSequenceCriteria(
+                    self.batch_tokenizer, self.model_service.stop_sequences, 0
+                )
+            
+            token_ids = request.token_ids + request.generated
+            request.past_key_values, request.length = self.model_service.kv_cache.lookup(
+                self._cache_key(request), token_ids
+            )
+            self.prefilling.append(request)
+    
+    def _prefill_chunks(self, model):
+        """Prefill up to prefill_chunk_size prompt tokens and move finished prompts into the batch."""
+        budget = self.prefill_chunk_size
+        
+        # Shortest remaining prompt first, so short requests aren't queued behind a long one
+        for request in sorted(self.prefilling, key=lambda r: len(r.token_ids) + len(r.generated) - r.length):
+            if budget <= 0:
+                break
+            
+            if request.cancelled:
+                self.prefilling.remove(request)
+                request.past_key_values = None
+                request.finish()
+                continue
+            
+            try:
+                logits, prefilled = self._prefill(model, request, budget)
+            except Exception as e:
+                logger.error(f"Error prefilling request: {str(e)}")
+                self.prefilling.remove(request)
+                request.past_key_values = None
+                request.finish(e)
+                continue
+            
+            budget -= prefilled
+            if logits is None:
+                continue
+            
+            self.prefilling.remove(request)
+            past_key_values, request.past_key_values = request.past_key_values, None
+            self._join(request, past_key_values)
+            
+            token = self._sample([request], logits)[0]
+            if self._append_token(request, token):
+                self._remove_rows([len(self.rows) - 1])
+    
+    def _prefill(self, model, request, max_tokens):
+        """
+        Extend a request's KV cache by the next chunk of its prompt.
+        
+        Args:
+            model: The model to run.
+            request (InferenceRequest): A request being prefilled.
+            max_tokens (int): Maximum number of prompt tokens to feed.
+        
+        Returns:
+            tuple: (logits for the next token, or None if the prompt isn't fully
+                   prefilled yet; number of tokens fed).
+        """
+        token_ids = request.token_ids + request.generated
+        end = min(len(token_ids), request.length + max_tokens)
+        device = self._device(model)
+        
+        input_ids = torch.tensor([token_ids[request.length:end]], dtype=torch.long, device=device)
+        position_ids = torch.arange(request.length, end, dtype=torch.long, device=device).unsqueeze(0)
+        attention_mask = torch.ones(1, end, dtype=torch.long, device=device)
+        
+        with torch.no_grad():
+            outputs = model(
+                input_ids=input_ids,
+                past_key_values=request.past_key_values,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                use_cache=True
+            )
+        
+        prefilled = end - request.length
+        request.past_key_values = outputs.past_key_values
+        request.length = end
+        
+        with self.condition:
+            self.stats['prefill_chunks'] += 1
+            self.stats['prefilled_tokens'] += prefilled
+        
+        if end < len(token_ids):
+            return None, prefilled
+        return outputs.logits[:, -1, :], prefilled
+    
+    def _decode(self, model):
+        """Feed every active request its last sampled token and sample the next one."""
+        device = self.attention_mask.device
+        batch_size = len(self.rows)
+        
+        input_ids = torch.tensor([[row.next_token] for row in self.rows], dtype=torch.long, device=device)
+        position_ids = torch.tensor([[row.length] for row in self.rows], dtype=torch.long, device=device)
+        attention_mask = torch.cat(
+            [self.attention_mask, torch.ones(batch_size, 1, dtype=torch.long, device=device)], dim=1
+        )
+        
+        with torch.no_grad():
+            outputs = model(
+                input_ids=input_ids,
+                past_key_values=self.past_key_values,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                use_cache=True
+            )
+        
+        self.past_key_values = outputs.past_key_values
+        self.attention_mask = attention_mask
+        for row in self.rows:
+            row.length += 1
+        
+        tokens = self._sample(self.rows, outputs.logits[:, -1, :])
+        finished = [i for i, (row, token) in enumerate(zip(self.rows, tokens)) if self._append_token(row, token)]
+        
+        with self.condition:
+            self.stats['decode_steps'] += 1
+            self.stats['decoded_rows'] += batch_size
+        
+        self._remove_rows(finished)
+    
+    def _speculative_decode(self, model, draft, lookup):
+        """
+        Advance a lone request by several tokens: earlier n-grams or the draft
+        model propose tokens and the target model checks all of them in one
+        forward pass. Falls back to a normal decode step when nothing is proposed.
+        """
+        row = self.rows[0]
+        
+        # Leave room for the token sampled after the drafts
+        room = row.max_new_tokens - len(row.generated) - 1
+        if room < 1:
+            self._decode(model)
+            return
+        
+        sequence = row.token_ids + row.generated
+        drafts = []
+        
+        # n-gram lookup is free, so the draft model only runs when it finds nothing
+        if lookup is not None:
+            drafts = lookup.propose(sequence, min(lookup.num_draft_tokens, room))
+            draft_probs = [None] * len(drafts)
+            proposer = lookup
+        if not drafts and draft is not None:
+            drafts, draft_probs = draft.propose(row, sequence, min(draft.num_draft_tokens, room), self._probs)
+            proposer = draft
+        if not drafts:
+            self._decode(model)
+            return
+        
+        device = self.attention_mask.device
+        batch_length = self.attention_mask.shape[1]
+        fed = [row.next_token] + drafts
+        
+        attention_mask = torch.cat(
+            [self.attention_mask, torch.ones(1, len(fed), dtype=torch.long, device=device)], dim=1
+        )
+        position_ids = torch.arange(row.length, row.length + len(fed), dtype=torch.long, device=device).unsqueeze(0)
+        
+        with torch.no_grad():
+            outputs = model(
+                input_ids=torch.tensor([fed], dtype=torch.long, device=device),
+                past_key_values=self.past_key_values,
+                attention_mask=attention_mask,
+                position_ids=position_ids,
+                use_cache=True
+            )
+        logits = outputs.logits[0]
+        
+        accepted, token = verify_draft(
+            drafts,
+            draft_probs,
+            lambda i: self._probs(sequence + drafts[:i], logits[i]),
+            lambda: self._probs(sequence + drafts, logits[len(drafts)])
+        )
+        
+        # Keep cache positions for the fed token and the accepted drafts only
+        keep = batch_length + 1 + accepted
+        self.past_key_values = KVCacheStore.crop(outputs.past_key_values, keep)
+        self.attention_mask = attention_mask[:, :keep]
+        row.length += 1 + accepted
+        
+        if draft is not None:
+            draft.rollback(len(sequence) + accepted)
+        proposer.record(len(drafts), accepted)
+        
+        with self.condition:
+            self.stats['decode_steps'] += 1
+            self.stats['decoded_rows'] += 1
+        
+        for new_token in drafts[:accepted] + [token]:
+            if self._append_token(row, new_token):
+                self._remove_rows([0])
+                return
+    
+    def _probs(self, context, logits):
+        """Sampling distribution for one position, given the tokens before it."""
+        input_ids = torch.tensor([context], dtype=torch.long, device=logits.device)
+        scores = self.processors(input_ids, logits.float().unsqueeze(0))
+        scores = self.warpers(input_ids, scores)
+        return torch.softmax(scores, dim=-1)[0]
+    
+    def _sample(self, rows, logits):
+        """Sample one token per row with the configured logits processors."""
+        sequences = [row.token_ids + row.generated for row in rows]
+        longest = max(len(sequence) for sequence in sequences)
+        
+        # Pad with a token already in the row, which leaves the repetition penalty unchanged
+        input_ids = torch.tensor(
+            [sequence + [sequence[0]] * (longest - len(sequence)) for sequence in sequences],
+            dtype=torch.long,
+            device=logits.device
+        )
+        
+        scores = self.processors(input_ids, logits.float())
+        scores = self.warpers(input_ids, scores)
+        probs = torch.softmax(scores, dim=-1)
+        return torch.multinomial(probs, num_samples=1).squeeze(1).tolist()
+    
+    def _append_token(self, request, token):
+        """
+        Record a sampled token and publish any new text.
+        
+        Returns:
+            bool: Whether the request has finished.
+        """
+        request.generated.append(token)
+        request.next_token = token
+        
+        with self.condition:
+            self.stats['generated_tokens'] += 1
+        
+        tokenizer = self.batch_tokenizer
+        
+        if request.stream_text:
+            text = tokenizer.decode(request.generated, skip_special_tokens=True)
+            # Wait for the rest of a multi-byte character
+            if not text.endswith('\ufffd') and len(text) > request.emitted_length:
+                request.pieces.put(text[request.emitted_length:])
+                request.emitted_length = len(text)
+        
+        return (
+            request.cancelled
+            or token == tokenizer.eos_token_id
+            or len(request.generated) >= request.max_new_tokens
+            or request.stop_criteria(torch.tensor([request.generated]), None)
+        )
+    
+    def _join(self, request, past_key_values):
+        """Add a prefilled request to the batch, left padding whichever cache is shorter."""
+        length = KVCacheStore.cache_length(past_key_values)
+        device = past_key_values[0][0].device
+        mask = torch.ones(1, length, dtype=torch.long, device=device)
+        
+        if not self.rows:
+            self.rows = [request]
+            self.past_key_values = past_key_values
+            self.attention_mask = mask
+            return
+        
+        batch_length = self.attention_mask.shape[1]
+        if length > batch_length:
+            self.past_key_values = self._pad_left(self.past_key_values, length - batch_length)
+            self.attention_mask = self._pad_mask(self.attention_mask, length - batch_length)
+        elif length < batch_length:
+            past_key_values = self._pad_left(past_key_values, batch_length - length)
+            mask = self._pad_mask(mask, batch_length - length)
+        
+        self.past_key_values = tuple(
+            (torch.cat([key, new_key], dim=0), torch.cat([value, new_value], dim=0))
+            for (key, value), (new_key, new_value) in zip(self.past_key_values, past_key_values)
+        )
+        self.attention_mask = torch.cat([self.attention_mask, mask], dim=0)
+        self.rows.append(request)
+    
+    def _remove_rows(self, indices):
+        """Finish the given rows, keeping their KV caches for the next turn."""
+        if not indices:
+            return
+        
+        batch_length = self.attention_mask.shape[1]
+        for i in indices:
+            row = self.rows[i]
+            if row.conversation_id:
+                # Copy the row out so the cache doesn't pin the whole batch in memory
+                start = batch_length - row.length
+                row_past = tuple(
+                    (key[i:i + 1, :, start:, :].clone(), value[i:i + 1, :, start:, :].clone())
+                    for key, value in self.past_key_values
+                )
+                token_ids = (row.token_ids + row.generated)[:row.length]
+                self.model_service.kv_cache.store(self._cache_key(row), token_ids, row_past)
+            row.finish()
+        
+        finished = set(indices)
+        keep = [i for i in range(len(self.rows)) if i not in finished]
+        if not keep:
+            self._reset_batch()
+            return
+        
+        index = torch.tensor(keep, dtype=torch.long, device=self.attention_mask.device)
+        self.rows = [self.rows[i] for i in keep]
+        self.attention_mask = self.attention_mask.index_select(0, index)
+        
+        # Drop leading columns that are padding for every remaining row
+        start = int((self.attention_mask.sum(dim=0) > 0).nonzero()[0])
+        self.attention_mask = self.attention_mask[:, start:]
+        self.past_key_values = tuple(
+            (key.index_select(0, index)[:, :, start:, :], value.index_select(0, index)[:, :, start:, :])
+            for key, value in self.past_key_values
+        )
+    
+    def _fail_all(self, error):
+        """Fail every active and waiting request."""
+        with self.condition:
+            waiting = list(self.waiting)
+            self.waiting.clear()
+        
+        for request in self.rows + self.prefilling + waiting:
+            request.past_key_values = None
+            request.finish(error)
+        self.prefilling = []
+        self._reset_batch()
+    
+    def _reset_batch(self):
+        """Forget the current batch."""
+        self.rows = []
+        self.past_key_values = None
+        self.attention_mask = None
+    
+    def _pad_left(self, past_key_values, padding):
+        """Prepend zero positions to per-layer (key, value) tensors."""
+        return tuple(
+            (
+                torch.cat([key.new_zeros(key.shape[0], key.shape[1], padding, key.shape[3]), key], dim=2),
+                torch.cat([value.new_zeros(value.shape[0], value.shape[1], padding, value.shape[3]), value], dim=2)
+            )
+            for key, value in past_key_values
+        )
+    
+    def _cache_key(self, request):
+        """KV cache key of a request; keys/values differ per adapter and published version."""
+        if not request.conversation_id:
+            return request.conversation_id
+        if request.adapter is not None:
+            return (request.conversation_id, request.adapter)
+        return (request.conversation_id, self.batch_version.number if self.batch_version is not None else None)
+    
+    def _device(self, model):
+        """Device of a model's weights; dynamically quantized models run on CPU."""
+        for param in model.parameters():
+            return param.device
+        return torch.device('cpu')
+    
+    def _pad_mask(self, attention_mask, padding):
+        """Prepend masked-out positions to an attention mask."""
+        return torch.cat([attention_mask.new_zeros(attention_mask.shape[0], padding), attention_mask], dim=1)
@@ -0,0 +1,157 @@
+from collections import OrderedDict
+from threading import Lock
+
+class KVCacheStore:
+    def __init__(self, max_bytes=512 * 1024 * 1024, min_reuse_tokens=8):
+        """
+        Initialize the per-conversation KV cache store.
+        
+        Each entry holds the attention key/value tensors (past_key_values)
+        computed for a conversation's last prompt plus reply, together with
+        the token IDs they cover. The next turn's prompt usually starts with
+        those tokens, so only the new part needs to be prefilled.
+        
+        Args:
+            max_bytes (int): Memory budget for all cached tensors.
+            min_reuse_tokens (int): Shortest shared prefix worth reusing.
+        """
+        self.max_bytes = max_bytes
+        self.min_reuse_tokens = min_reuse_tokens
+        
+        self.entries = OrderedDict()  # conversation_id -> (token_ids, past_key_values, size)
+        self.total_bytes = 0
+        self.lock = Lock()
+        
+        self.stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'reused_tokens': 0,
+            'prefilled_tokens': 0
+        }
+    
+    def lookup(self, conversation_id, token_ids):
+        """
+        Find cached keys/values for the longest shared prefix of a prompt.
+        
+        The entry is removed from the store while in use and should be put
+        back with store() once generation finishes.
+        
+        Args:
+            conversation_id (str): The conversation the prompt belongs to.
+            token_ids (list): The full prompt token IDs.
+        
+        Returns:
+            tuple: (past_key_values, reused_length), or (None, 0) on a miss.
+        """
+        with self.lock:
+            entry = self.entries.pop(conversation_id, None) if conversation_id else None
+            if entry is not None:
+                self.total_bytes -= entry[2]
+        
+        reused = 0
+        past_key_values = None
+        
+        if entry is not None:
+            cached_ids, cached_past, _ = entry
+            reused = self._common_prefix_length(cached_ids, token_ids)
+            
+            # At least one prompt token must be fed to the model to get logits
+            reused = min(reused, len(token_ids) - 1)
+            
+            if reused >= self.min_reuse_tokens:
+                past_key_values = self.crop(cached_past, reused)
+            else:
+                reused = 0
+        
+        with self.lock:
+            if past_key_values is not None:
+                self.stats['hits'] += 1
+            else:
+                self.stats['misses'] += 1
+            self.stats['reused_tokens'] += reused
+            self.stats['prefilled_tokens'] += len(token_ids) - reused
+        
+        return past_key_values, reused
+    
+    def store(self, conversation_id, token_ids, past_key_values):
+        """
+        Cache keys/values for a conversation, evicting old entries to stay in budget.
+        
+        Args:
+            conversation_id (str): The conversation the tokens belong to.
+            token_ids (list): The token IDs covered by past_key_values.
+            past_key_values: Per-layer (key, value) tensors.
+        """
+        if not conversation_id or past_key_values is None:
+            return
+        
+        size = self._size(past_key_values)
+        if size > self.max_bytes:
+            return
+        
+        with self.lock:
+            old = self.entries.pop(conversation_id, None)
+            if old is not None:
+                self.total_bytes -= old[2]
+            
+            self.entries[conversation_id] = (list(token_ids), past_key_values, size)
+            self.total_bytes += size
+            
+            while self.total_bytes > self.max_bytes and self.entries:
+                _, (_, _, evicted_size) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+                self.stats['evictions'] += 1
+    
+    def invalidate(self, conversation_id):
+        """Drop the cached keys/values of one conversation."""
+        with self.lock:
+            entry = self.entries.pop(conversation_id, None)
+            if entry is not None:
+                self.total_bytes -= entry[2]
+    
+    def clear(self):
+        """Drop everything, e.g. after the model weights change."""
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+    
+    def get_stats(self):
+        """Get hit rate, token reuse and memory statistics."""
+        with self.lock:
+            stats = dict(self.stats)
+            lookups = stats['hits'] + stats['misses']
+            total_tokens = stats['reused_tokens'] + stats['prefilled_tokens']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0
+            stats['token_reuse_rate'] = stats['reused_tokens'] / total_tokens if total_tokens else 0
+            stats['entries'] = len(self.entries)
+            stats['bytes'] = self.total_bytes
+            return stats
+    
+    @staticmethod
+    def crop(past_key_values, length):
+        """Keep the first length positions of per-layer (key, value) tensors."""
+        return tuple(
+            (key[:, :, :length, :], value[:, :, :length, :])
+            for key, value in past_key_values
+        )
+    
+    @staticmethod
+    def cache_length(past_key_values):
+        """Number of positions covered by per-layer (key, value) tensors."""
+        return past_key_values[0][0].shape[2]
+    
+    def _size(self, past_key_values):
+        """Memory used by per-layer (key, value) tensors, in bytes."""
+        return sum(
+            key.nelement() * key.element_size() + value.nelement() * value.element_size()
+            for key, value in past_key_values
+        )
+    
+    def _common_prefix_length(self, a, b):
+        """Length of the common prefix of two token ID lists."""
+        length = min(len(a), len(b))
+        for i in range(length):
+            if a[i] != b[i]:
+                return i
+        return length
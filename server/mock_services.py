@@ -5,6 +5,8 @@ import random
 import uuid
 import math
 
+from server.write_queue import WriteBehindQueue
+
 class MockModelService:
     def __init__(self):
         self.model_loaded = False
@@ -354,6 +356,7 @@ class MockDatabase:
         self.training_metadata = []
         self.sync_metadata = []
         self.settings = {}
+        self.write_queue = None
     
     def initialize(self):
         # Create directory if it doesn't exist
@@ -378,7 +381,32 @@ class MockDatabase:
             # If loading fails, use empty data
             pass
     
+    def set_durability_mode(self, mode, flush_interval=0.005):
+        # In write-behind mode, a burst of changes is written to disk once
+        if mode == 'write_behind':
+            if self.write_queue is None:
+                self.write_queue = WriteBehindQueue(lambda batch: self._write_data_file(), flush_interval=flush_interval)
+        elif self.write_queue is not None:
+            self.write_queue.close()
+            self.write_queue = None
+    
+    def flush(self):
+        if self.write_queue is not None:
+            self.write_queue.flush()
+    
+    def close(self):
+        if self.write_queue is not None:
+            self.write_queue.close()
+            self.write_queue = None
+    
     def _save_data(self):
+        if self.write_queue is not None:
+            self.write_queue.submit('save')
+            return
+        
+        self._write_data_file()
+    
+    def _write_data_file(self):
         data = {
             'conversations': self.conversations,
             'model_metadata': self.model_metadata,
@@ -387,10 +415,13 @@ class MockDatabase:
             'settings': self.settings
         }
         
+        # Serialize before opening the file so a slow disk doesn't hold up the snapshot
+        serialized = json.dumps(data)
+        
         os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
         
         with open(self.db_path, 'w') as f:
-            json.dump(data, f)
+            f.write(serialized)
     
     def save_conversation(self, conversation):
         if not conversation.get('id'):
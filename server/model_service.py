@@ -1,11 +1,32 @@
 import os
+import sys
 import logging
 import json
 import time
+import copy
+from threading import Lock, RLock, Thread
 import torch
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from peft import get_peft_model, LoraConfig, TaskType, PeftModel, PeftConfig
-import numpy as np
+from safetensors import safe_open
+from safetensors.torch import save_file
+from transformers.utils import is_accelerate_available
+
+# resource is Unix-only; peak RSS isn't reported without it
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from kv_cache import KVCacheStore
+from context_builder import ContextBuilder
+from stop_sequences import DEFAULT_STOP_SEQUENCES, StopSequenceBuffer, trim_at_stop
+from inference_engine import InferenceEngine
+from precision import INFERENCE_PRECISIONS, convert_for_inference, model_memory_bytes
+from adapter_registry import AdapterRegistry
+from speculative import DraftModel, PromptLookupProposer
+from worker_pool import InferenceWorkerPool
+from model_version import ModelVersion
 
 # Configure logging
 logging.basicConfig(
@@ -15,12 +36,68 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 class ModelService:
+    # Smaller model of the same tokenizer family used to draft tokens for each model
+    DEFAULT_DRAFT_MODELS = {
+        "gpt2-psychpal-small": "distilgpt2-psychpal"
+    }
+    
     def __init__(self):
         self.model = None
         self.tokenizer = None
         self.model_id = None
         self.model_path = None
         self.lora_config = None
+        self.last_epoch_examples = 0
+        self.load_stats = {}
+        
+        # Attention keys/values from each conversation's previous turn
+        self.kv_cache = KVCacheStore()
+        
+        # Prompt token budget; None uses the model's full context size
+        self.max_context_tokens = None
+        self.max_new_tokens = 100
+        
+        # Generation also ends at EOS, which the model config provides
+        self.stop_sequences = list(DEFAULT_STOP_SEQUENCES)
+        self.context_builder = None
+        
+        # Inference runs on the published version: a separate copy with adapters
+        # merged in, at the configured precision, while self.model stays fp32
+        # for training. Without an adapter at fp32 the untouched base model is
+        # published itself; training then wraps a copy. Publishing a new
+        # version is a single assignment, so serving never waits for it.
+        self.inference_precision = 'fp32'
+        self.published = None
+        self.version_count = 0
+        self.publish_lock = Lock()
+        
+        # Held by the inference worker for each step; taken to swap in a newly loaded model
+        self.model_lock = RLock()
+        
+        # Held for each training step and weight update, and while copying weights
+        self.weights_lock = RLock()
+        
+        # Speculative decoding: model ID -> draft model ID, or None to turn it off
+        self.speculative_models = dict(self.DEFAULT_DRAFT_MODELS)
+        self.draft_model = None
+        
+        # Draft-free speculative decoding from n-grams already in the prompt; None when off
+        self.prompt_lookup = None
+        
+        # Named adapters served side by side over one more copy of the base weights
+        self.adapters = AdapterRegistry()
+        self.adapter_base_lock = Lock()
+        
+        self.rebuild_lock = Lock()
+        self.rebuild_running = False
+        self.rebuild_pending = False
+        
+        self.engine = InferenceEngine(self)
+        
+        # Forked inference worker processes; None serves from this process
+        self.inference_workers = 1
+        self.workers = None
+        
         self.adapters_dir = os.path.join('data', 'adapters')
         self.models_dir = os.path.join('data', 'models')
         
@@ -60,9 +137,20 @@ class ModelService:
             "name": self.model_id,
             "size": round(model_size_mb, 2),
             "path": self.model_path,
+            "load": self.load_stats,
             "lastUpdated": time.time(),
             "parameters": sum(p.numel() for p in self.model.parameters()),
-            "has_adapters": hasattr(self.model, "peft_config")
+            "has_adapters": hasattr(self.model, "peft_config"),
+            "precision": self.get_active_precision(),
+            "inference_size": round(model_memory_bytes(self.get_inference_model()) / (1024 * 1024), 2),
+            "kv_cache": self.kv_cache.get_stats(),
+            "context": self.context_builder.get_stats() if self.context_builder else None,
+            "inference": self.engine.get_stats(),
+            "adapters": self.adapters.get_stats(),
+            "speculative": self.draft_model.get_stats() if self.draft_model else None,
+            "prompt_lookup": self.prompt_lookup.get_stats() if self.prompt_lookup else None,
+            "version": self.published.get_stats() if self.published else None,
+            "workers": self.workers.get_stats() if self.workers else None
         }
     
     def get_available_models(self):
@@ -111,8 +199,9 @@ class ModelService:
             tokenizer = AutoTokenizer.from_pretrained(hf_model_id)
             model = AutoModelForCausalLM.from_pretrained(hf_model_id)
             
-            # Save the model and tokenizer to the local directory
-            model.save_pretrained(model_dir)
+            # Save the model and tokenizer to the local directory, with weights
+            # as safetensors so they can be memory-mapped on load
+            model.save_pretrained(model_dir, safe_serialization=True)
             tokenizer.save_pretrained(model_dir)
             
             # Create a model info file
@@ -137,15 +226,21 @@ class ModelService:
     def load_model(self, model_id, model_path):
         """Load a model from local storage."""
         try:
+            started = time.time()
+            rss_before = self._peak_rss_mb()
+            
             # Load the tokenizer
-            self.tokenizer = AutoTokenizer.from_pretrained(model_path)
+            tokenizer = AutoTokenizer.from_pretrained(model_path)
             
-            # Load the base model
-            self.model = AutoModelForCausalLM.from_pretrained(model_path)
+            # Load the base model; safetensors weights are memory-mapped, and with
+            # accelerate installed they are loaded straight into place instead of
+            # over randomly initialized ones
+            model = AutoModelForCausalLM.from_pretrained(model_path, low_cpu_mem_usage=is_accelerate_available())
+            self._convert_model_to_safetensors(model, model_path)
             
             # Move model to GPU if available
             device = "cuda" if torch.cuda.is_available() else "cpu"
-            self.model = self.model.to(device)
+            model = model.to(device)
             
             # Configure LoRA for fine-tuning
             self.lora_config = LoraConfig(
@@ -162,168 +257,517 @@ class ModelService:
             if latest_adapter:
                 # Load the adapter
                 logger.info(f"Loading adapter from {latest_adapter}")
-                self.model = PeftModel.from_pretrained(self.model, latest_adapter)
-            
-            self.model_id = model_id
-            self.model_path = model_path
+                self._convert_adapter_to_safetensors(latest_adapter)
+                model = PeftModel.from_pretrained(model, latest_adapter)
+            
+            load_seconds = time.time() - started
+            
+            # Token IDs are cached per tokenizer, so start a fresh builder
+            context_size = getattr(model.config, 'n_positions', None) or getattr(model.config, 'max_position_embeddings', 1024)
+            if self.max_context_tokens:
+                context_size = min(context_size, int(self.max_context_tokens))
+            context_builder = ContextBuilder(tokenizer, max_tokens=context_size, reserve_tokens=self.max_new_tokens)
+            
+            inference_model, precision = self._build_inference_model(model)
+            draft_model = self._load_draft_model(model_id, tokenizer, device)
+            
+            # Swap between inference steps
+            with self.model_lock, self.publish_lock:
+                self.model = model
+                self._publish(inference_model, precision)
+                self.draft_model = draft_model
+                self.adapters.reset()
+                self.tokenizer = tokenizer
+                self.context_builder = context_builder
+                self.model_id = model_id
+                self.model_path = model_path
+            self._sync_workers()
+            
+            rss_after = self._peak_rss_mb()
+            self.load_stats = {
+                "load_seconds": round(load_seconds, 2),
+                "total_seconds": round(time.time() - started, 2),
+                "peak_rss_mb": rss_after,
+                "peak_rss_increase_mb": (
+                    round(rss_after - rss_before, 2) if rss_after is not None and rss_before is not None else None
+                )
+            }
             
-            logger.info(f"Loaded model {model_id} from {model_path}")
+            logger.info(f"Loaded model {model_id} from {model_path} in {load_seconds:.1f}s")
             return True
             
         except Exception as e:
             logger.error(f"Error loading model {model_id}: {str(e)}")
-            self.model = None
-            self.tokenizer = None
+            with self.model_lock:
+                self.model = None
+                self.published = None
+                self.draft_model = None
+                self.tokenizer = None
+                self.context_builder = None
             raise
     
-    def generate_response(self, message, conversation_history):
-        """Generate a response to a message using the loaded model."""
+    def warm_up(self):
+        """Run one short generation so the first real request doesn't pay one-time setup costs."""
+        if not self.is_model_loaded():
+            return
+        
+        token_ids = self.context_builder.build([{'role': 'user', 'content': 'Hello'}])
+        self.engine.submit(token_ids, max_new_tokens=1).result()
+    
+    def start_workers(self, num_workers=None):
+        """
+        Fork inference worker processes; must be called before the model is loaded.
+        
+        torch's OpenMP thread pool doesn't survive a fork, so the workers are
+        forked while no torch op has run yet and then sent each published
+        version and serving setting through _sync_workers(). With one worker,
+        inference runs in this process.
+        
+        Args:
+            num_workers (int, optional): Number of workers; defaults to self.inference_workers.
+        """
+        if num_workers is not None:
+            self.inference_workers = num_workers
+        if self.workers is not None or self.inference_workers <= 1:
+            return
+        if torch.cuda.is_available():
+            raise ValueError("Inference workers are only supported on CPU")
+        
+        workers = InferenceWorkerPool(self, self.inference_workers)
+        workers.start()
+        self.workers = workers
+    
+    def stop_workers(self):
+        """Let the worker processes finish their requests and exit; inference then runs in this process."""
+        workers = self.workers
+        self.workers = None
+        if workers is not None:
+            workers.stop()
+    
+    def _sync_workers(self):
+        """Send the published version and serving settings to the worker processes, if running."""
+        workers = self.workers
+        if workers is None or self.published is None:
+            return
+        
+        draft_model = self.draft_model
+        settings = {
+            'tokenizer': self.tokenizer,
+            'model_id': self.model_id,
+            'stop_sequences': list(self.stop_sequences),
+            'draft': (draft_model.model, draft_model.model_id) if draft_model is not None else None,
+            'prompt_lookup': self.prompt_lookup is not None
+        }
+        
+        try:
+            workers.sync(self.published, settings)
+        except Exception as e:
+            logger.error(f"Error syncing inference workers: {str(e)}")
+    
+    def _submit(self, token_ids, conversation_id=None, max_new_tokens=100, stream=False, adapter=None):
+        """Queue a prompt on the worker processes if running, otherwise on this process's engine."""
+        workers = self.workers
+        
+        if adapter is not None:
+            # Copy the base weights here rather than on the inference worker, which would stall every batch
+            self._prepare_adapter_base()
+        
+        # Adapters are served by this process, which has the training weights to apply them to
+        if workers is not None and adapter is None and workers.synced_version is not None:
+            try:
+                return workers.submit(token_ids, conversation_id, max_new_tokens, stream)
+            except ValueError:
+                # The workers are stopping; serve this one here
+                pass
+        return self.engine.submit(token_ids, conversation_id, max_new_tokens, stream, adapter)
+    
+    def get_inference_model(self):
+        """Get the model that serves generation requests."""
+        published = self.published
+        return published.model if published is not None else None
+    
+    def get_serving_model(self, adapter=None, version=None):
+        """
+        Get the model to run a request on; called by the inference worker.
+        
+        Args:
+            adapter (str, optional): Name of a saved adapter to use instead of the current weights.
+            version (ModelVersion, optional): Published version to use; defaults to the latest.
+        """
+        if adapter is None:
+            version = version or self.published
+            return version.model if version is not None else None
+        
+        if not self.is_model_loaded():
+            return None
+        
+        path = os.path.join(self.adapters_dir, adapter)
+        if os.path.basename(adapter) != adapter or not os.path.isdir(path):
+            raise ValueError(f"Unknown adapter: {adapter}")
+        
+        self._convert_adapter_to_safetensors(path)
+        
+        # Normally built when the request was submitted; only a reset meanwhile leaves it missing
+        if not self.adapters.has_base():
+            self._prepare_adapter_base()
+        
+        # PEFT adapter names can't contain dots
+        return self.adapters.activate(adapter.replace('.', '_'), path)
+    
+    def _prepare_adapter_base(self):
+        """Build the base model that named adapters are served on, if it isn't built yet."""
+        with self.adapter_base_lock:
+            if self.adapters.has_base():
+                return
+            
+            source = self.model
+            if source is None:
+                return
+            generation = self.adapters.generation
+            
+            # Adapters are served at the inference precision, except int8: PEFT
+            # can't wrap dynamically quantized layers
+            precision = self.inference_precision
+            if precision == 'int8':
+                logger.warning("Serving adapters at fp32; int8 layers can't take LoRA adapters")
+                precision = 'fp32'
+            
+            started = time.time()
+            base = self._copy_weights(source)
+            if isinstance(base, PeftModel):
+                # Drop the training adapter; saved adapters apply to the plain base
+                base = base.unload()
+            base = convert_for_inference(base, precision)
+            
+            if self.model is source and self.adapters.set_base(base, generation):
+                logger.info(f"Built {precision} adapter base model in {time.time() - started:.1f}s")
+    
+    def list_adapters(self):
+        """List the saved adapters of the current model, newest first."""
+        if not self.model_id:
+            return []
+        
+        prefix = f"{self.model_id}_adapter_"
+        names = sorted(
+            (d for d in os.listdir(self.adapters_dir)
+             if os.path.isdir(os.path.join(self.adapters_dir, d)) and d.startswith(prefix)),
+            reverse=True
+        )
+        loaded = set(self.adapters.loaded)
+        
+        return [{"name": name, "loaded": name.replace('.', '_') in loaded} for name in names]
+    
+    def set_speculative_decoding(self, enabled, draft_model_id=None):
+        """
+        Turn speculative decoding on or off for the loaded model.
+        
+        Args:
+            enabled (bool): Whether to draft tokens with a smaller model.
+            draft_model_id (str, optional): The draft model; defaults to the known
+                                            smaller model of the same family.
+        """
         if not self.is_model_loaded():
             raise ValueError("No model is loaded")
         
+        if enabled:
+            draft_model_id = draft_model_id or self.DEFAULT_DRAFT_MODELS.get(self.model_id)
+            if not draft_model_id:
+                raise ValueError(f"No draft model known for {self.model_id}")
+        
+        self.speculative_models[self.model_id] = draft_model_id if enabled else None
+        
+        device = next(self.model.parameters()).device
+        draft_model = self._load_draft_model(self.model_id, self.tokenizer, device) if enabled else None
+        if enabled and draft_model is None:
+            raise ValueError(f"Draft model {draft_model_id} could not be loaded; is it downloaded?")
+        
+        with self.model_lock:
+            self.draft_model = draft_model
+        self._sync_workers()
+    
+    def set_prompt_lookup(self, enabled):
+        """
+        Turn prompt-lookup decoding on or off.
+        
+        Args:
+            enabled (bool): Whether to draft tokens from n-grams earlier in the conversation.
+        """
+        if enabled and self.prompt_lookup is None:
+            self.prompt_lookup = PromptLookupProposer()
+        elif not enabled:
+            self.prompt_lookup = None
+        else:
+            return
+        self._sync_workers()
+    
+    def _load_draft_model(self, model_id, tokenizer, device):
+        """
+        Load the draft model configured for a model.
+        
+        Returns:
+            DraftModel: The draft model, or None if speculative decoding is off
+                        or the draft model isn't usable.
+        """
+        draft_model_id = self.speculative_models.get(model_id)
+        if not draft_model_id or draft_model_id == model_id:
+            return None
+        
+        draft_path = os.path.join(self.models_dir, draft_model_id)
+        if not os.path.isdir(draft_path):
+            logger.info(f"Draft model {draft_model_id} not downloaded, speculative decoding off")
+            return None
+        
         try:
-            # Format the conversation history for the model
-            formatted_prompt = self._format_conversation(conversation_history)
+            # Drafted token IDs are verified by the target model, so the vocabularies must match
+            draft_tokenizer = AutoTokenizer.from_pretrained(draft_path)
+            if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+                logger.warning(f"Draft model {draft_model_id} uses a different tokenizer, speculative decoding off")
+                return None
             
-            # Generate a response
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            inputs = self.tokenizer(formatted_prompt, return_tensors="pt").to(device)
-            
-            # Set generation parameters
-            gen_kwargs = {
-                "max_length": inputs["input_ids"].shape[1] + 100,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "top_k": 50,
-                "repetition_penalty": 1.2,
-                "do_sample": True,
-                "pad_token_id": self.tokenizer.eos_token_id
-            }
+            model = AutoModelForCausalLM.from_pretrained(draft_path, low_cpu_mem_usage=is_accelerate_available())
+            model = model.to(device)
+            model = convert_for_inference(model, self.inference_precision)
             
-            # Generate response
-            with torch.no_grad():
-                output_sequences = self.model.generate(**inputs, **gen_kwargs)
+            logger.info(f"Loaded draft model {draft_model_id} for speculative decoding")
+            return DraftModel(model, draft_model_id)
+        
+        except Exception as e:
+            logger.error(f"Error loading draft model {draft_model_id}: {str(e)}")
+            return None
+    
+    def get_active_precision(self):
+        """Get the precision inference is actually running at."""
+        published = self.published
+        return published.precision if published is not None else 'fp32'
+    
+    def set_inference_precision(self, precision):
+        """
+        Switch the precision used for inference.
+        
+        Args:
+            precision (str): 'fp32', 'bf16' or 'int8'.
+        """
+        if precision not in INFERENCE_PRECISIONS:
+            raise ValueError(f"Unknown inference precision: {precision}")
+        
+        self.inference_precision = precision
+        if self.is_model_loaded():
+            # Adapters are served at the inference precision too
+            self.adapters.reset()
+            self._refresh_inference_model()
+    
+    def _schedule_inference_rebuild(self):
+        """Rebuild the inference model in the background; requests keep using the current one."""
+        with self.rebuild_lock:
+            if self.rebuild_running:
+                # The running rebuild may have copied the weights already
+                self.rebuild_pending = True
+                return
+            self.rebuild_running = True
+        
+        Thread(target=self._run_inference_rebuilds, daemon=True).start()
+    
+    def _run_inference_rebuilds(self):
+        """Rebuild until no further rebuild was requested meanwhile."""
+        while True:
+            try:
+                self._refresh_inference_model()
+            except Exception as e:
+                logger.error(f"Error rebuilding inference model: {str(e)}")
+            
+            with self.rebuild_lock:
+                if not self.rebuild_pending:
+                    self.rebuild_running = False
+                    return
+                self.rebuild_pending = False
+    
+    def _refresh_inference_model(self):
+        """Rebuild the inference model from the current training weights and swap it in."""
+        source = self.model
+        if source is None:
+            return
+        
+        inference_model, precision = self._build_inference_model(source)
+        
+        # Publish unless another model was loaded meanwhile
+        with self.publish_lock:
+            if self.model is not source:
+                return
+            self._publish(inference_model, precision)
+        
+        logger.info(f"Published rebuilt {precision} inference model as version {self.version_count}")
+        self._sync_workers()
+    
+    def _publish(self, model, precision):
+        """
+        Make a model the served version; the caller holds publish_lock.
+        
+        Batches already running finish on the version they started with; the
+        engine starts the next batch on this one.
+        """
+        self.version_count += 1
+        self.published = ModelVersion(self.version_count, model, precision)
+        
+        # Cached keys/values belong to the previous weights; the engine keys
+        # them by version, so entries a draining batch stores later never match
+        self.kv_cache.clear()
+    
+    def _build_inference_model(self, source):
+        """
+        Build the inference model: adapters merged into the base weights, at the configured precision.
+        
+        Returns:
+            tuple: (model, precision); the model is source itself when it has no
+                   adapter and runs at fp32, since training never modifies it in place.
+        """
+        if self.inference_precision == 'fp32' and not isinstance(source, PeftModel):
+            return source, 'fp32'
+        
+        started = time.time()
+        try:
+            inference_model = convert_for_inference(self._copy_weights(source), self.inference_precision)
+            logger.info(f"Built {self.inference_precision} inference model in {time.time() - started:.1f}s")
+            return inference_model, self.inference_precision
+        except Exception as e:
+            if self.inference_precision == 'fp32':
+                raise
+            logger.error(f"Error building {self.inference_precision} inference model, using fp32: {str(e)}")
+        
+        if not isinstance(source, PeftModel):
+            return source, 'fp32'
+        return convert_for_inference(self._copy_weights(source), 'fp32'), 'fp32'
+    
+    def _copy_weights(self, model):
+        """Copy a model without catching a training step half applied."""
+        with self.weights_lock:
+            return copy.deepcopy(model)
+    
+    def generate_response(self, message, conversation_history, conversation_id=None, adapter=None):
+        """
+        Generate a response to a message using the loaded model.
+        
+        The prompt is handed to the inference engine, which batches it with
+        other concurrent requests. When conversation_id is given, the
+        attention keys/values computed for the previous turn are reused, so
+        only the new part of the prompt is prefilled. adapter names a saved
+        adapter to answer with instead of the current weights.
+        """
+        if not self.is_model_loaded():
+            raise ValueError("No model is loaded")
+        
+        try:
+            # Build the prompt from the newest messages that fit the context
+            token_ids = self.context_builder.build(conversation_history, conversation_id)
             
-            # Decode the generated response
-            response = self.tokenizer.decode(output_sequences[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
+            request = self._submit(token_ids, conversation_id, max_new_tokens=self.max_new_tokens, adapter=adapter)
             
-            return response.strip()
+            return self._decode_response(request.result())
             
         except Exception as e:
             logger.error(f"Error generating response: {str(e)}")
             return "I'm having trouble processing your message right now. Could you try again?"
     
-    def generate_response_from_messages(self, messages):
+    def generate_response_stream(self, message, conversation_history, conversation_id=None, adapter=None):
+        """
+        Generate a response, yielding text as soon as tokens are decoded.
+        
+        Errors raised by generation are re-raised once the stream ends. If
+        the consumer stops early, generation is cancelled.
+        
+        Yields:
+            str: Successive pieces of the response text.
+        """
+        if not self.is_model_loaded():
+            raise ValueError("No model is loaded")
+        
+        token_ids = self.context_builder.build(conversation_history, conversation_id)
+        request = self._submit(
+            token_ids, conversation_id, max_new_tokens=self.max_new_tokens, stream=True, adapter=adapter
+        )
+        
+        try:
+            stop_buffer = StopSequenceBuffer(self.stop_sequences)
+            started = False
+            for text in self._stop_filtered(request.stream(), stop_buffer):
+                # Match generate_response, which strips leading whitespace
+                if not started:
+                    text = text.lstrip()
+                    if not text:
+                        continue
+                    started = True
+                yield text
+        finally:
+            request.cancel()
+    
+    def generate_response_from_messages(self, messages, adapter=None):
         """Generate a response from a list of messages."""
         if not self.is_model_loaded():
             raise ValueError("No model is loaded")
         
         try:
-            # Format the messages for the model
-            formatted_prompt = ""
-            for msg in messages:
-                role = msg.get('role', 'user')
-                content = msg.get('content', '')
-                
-                if role == 'user':
-                    formatted_prompt += f"User: {content}\n"
-                elif role == 'assistant':
-                    formatted_prompt += f"Assistant: {content}\n"
-            
-            formatted_prompt += "Assistant: "
+            # Build the prompt from the newest messages that fit the context
+            token_ids = self.context_builder.build(messages)
             
-            # Generate a response
-            device = "cuda" if torch.cuda.is_available() else "cpu"
-            inputs = self.tokenizer(formatted_prompt, return_tensors="pt").to(device)
-            
-            # Set generation parameters
-            gen_kwargs = {
-                "max_length": inputs["input_ids"].shape[1] + 100,
-                "temperature": 0.7,
-                "top_p": 0.9,
-                "top_k": 50,
-                "repetition_penalty": 1.2,
-                "do_sample": True,
-                "pad_token_id": self.tokenizer.eos_token_id
-            }
+            request = self._submit(token_ids, max_new_tokens=self.max_new_tokens, adapter=adapter)
             
-            # Generate response
-            with torch.no_grad():
-                output_sequences = self.model.generate(**inputs, **gen_kwargs)
-            
-            # Decode the generated response
-            response = self.tokenizer.decode(output_sequences[0][inputs["input_ids"].shape[1]:], skip_special_tokens=True)
-            
-            return response.strip()
+            return self._decode_response(request.result())
             
         except Exception as e:
             logger.error(f"Error generating response from messages: {str(e)}")
             return "I'm having trouble processing your message right now. Could you try again?"
     
-    def _format_conversation(self, conversation_history):
-        """Format conversation history for the model."""
-        formatted_prompt = ""
-        for message in conversation_history:
-            role = message.get('role', 'user')
-            content = message.get('content', '')
-            
-            if role == 'user':
-                formatted_prompt += f"User: {content}\n"
-            elif role == 'assistant':
-                formatted_prompt += f"Assistant: {content}\n"
-        
-        # Add the assistant prefix for the next response
-        formatted_prompt += "Assistant: "
+    def _decode_response(self, generated):
+        """Decode generated token IDs into reply text, cut at the first stop sequence."""
+        response = self.tokenizer.decode(generated, skip_special_tokens=True)
+        response, _ = trim_at_stop(response, self.stop_sequences)
         
-        return formatted_prompt
+        return response.strip()
     
-    def prepare_training_data(self, conversations):
-        """Prepare training data from conversations."""
-        training_data = []
+    def _stop_filtered(self, pieces, stop_buffer):
+        """Relay streamed text up to the first stop sequence."""
+        for text in pieces:
+            text = stop_buffer.push(text)
+            if text:
+                yield text
         
-        for conversation in conversations:
-            messages = conversation.get('messages', [])
-            
-            # Process messages to create training pairs
-            for i in range(len(messages) - 1):
-                # Only use message pairs where user asks and assistant responds
-                if (messages[i].get('role') == 'user' and 
-                    messages[i+1].get('role') == 'assistant'):
-                    
-                    training_data.append({
-                        'input': messages[i].get('content', ''),
-                        'output': messages[i+1].get('content', '')
-                    })
-        
-        return training_data
+        text = stop_buffer.finish()
+        if text:
+            yield text
     
     def train_epoch(self, training_data, batch_size=4, learning_rate=0.0001):
-        """Train the model for one epoch on the provided data."""
+        """
+        Train the model for one epoch on the provided data.
+        
+        training_data can be any iterable of {'input', 'output'} pairs, including
+        a generator; it is consumed one batch at a time. The number of examples
+        seen is stored in self.last_epoch_examples.
+        """
         if not self.is_model_loaded():
             raise ValueError("No model is loaded")
         
         try:
             # Check if we're already using a PEFT model
             if not hasattr(self.model, "peft_config"):
-                # Apply LoRA to the model
+                # LoRA layers are injected in place, so wrap a copy; the
+                # published version keeps serving the untouched base model
                 logger.info("Applying LoRA adapter to the model")
-                self.model = get_peft_model(self.model, self.lora_config)
+                self.model = get_peft_model(self._copy_weights(self.model), self.lora_config)
                 self.model.print_trainable_parameters()  # Log trainable parameters
             
-            # Prepare the optimizer
-            optimizer = torch.optim.AdamW(self.model.parameters(), lr=learning_rate)
+            model = self.model
             
-            # Set the model to training mode
-            self.model.train()
-            device = next(self.model.parameters()).device
+            # Prepare the optimizer
+            optimizer = torch.optim.AdamW(model.parameters(), lr=learning_rate)
+            device = next(model.parameters()).device
             
             # Process training data in batches
             total_loss = 0
             num_batches = 0
+            num_examples = 0
             
-            # Simple batching
-            for i in range(0, len(training_data), batch_size):
-                batch = training_data[i:i+batch_size]
+            # Simple batching, pulling only one batch from the iterable at a time
+            for batch in self._iter_batches(training_data, batch_size):
+                num_examples += len(batch)
                 
                 # Prepare inputs and outputs
                 batch_inputs = []
@@ -344,21 +788,29 @@ class ModelService:
                 labels = self.tokenizer(batch_outputs, return_tensors="pt", padding=True, truncation=True)
                 labels = labels["input_ids"].to(device)
                 
-                # Forward pass
-                outputs = self.model(**inputs, labels=labels)
-                loss = outputs.loss
-                
-                # Backward pass and optimization
-                loss.backward()
-                optimizer.step()
-                optimizer.zero_grad()
+                # Weights are only copied between training steps, never during one
+                with self.weights_lock:
+                    # Set the model to training mode
+                    model.train()
+                    
+                    # Forward pass
+                    outputs = model(**inputs, labels=labels)
+                    loss = outputs.loss
+                    
+                    # Backward pass and optimization
+                    loss.backward()
+                    optimizer.step()
+                    optimizer.zero_grad()
+                    
+                    model.eval()
                 
                 total_loss += loss.item()
                 num_batches += 1
             
             # Calculate average loss
             avg_loss = total_loss / num_batches if num_batches > 0 else 0
-            logger.info(f"Training epoch completed with average loss: {avg_loss}")
+            self.last_epoch_examples = num_examples
+            logger.info(f"Training epoch completed on {num_examples} examples with average loss: {avg_loss}")
             
             return avg_loss
             
@@ -366,6 +818,17 @@ class ModelService:
             logger.error(f"Error during training: {str(e)}")
             raise
     
+    def _iter_batches(self, iterable, batch_size):
+        """Group an iterable into lists of at most batch_size items."""
+        batch = []
+        for item in iterable:
+            batch.append(item)
+            if len(batch) == batch_size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+    
     def save_trained_adapter(self):
         """Save the trained LoRA adapter."""
         if not self.is_model_loaded() or not hasattr(self.model, "peft_config"):
@@ -377,9 +840,13 @@ class ModelService:
             adapter_dir = os.path.join(self.adapters_dir, f"{self.model_id}_adapter_{timestamp}")
             
             # Save the adapter
-            self.model.save_pretrained(adapter_dir)
+            with self.weights_lock:
+                self.model.save_pretrained(adapter_dir, safe_serialization=True)
             logger.info(f"Saved trained adapter to {adapter_dir}")
             
+            # Serve the new weights once a merged copy is ready
+            self._schedule_inference_rebuild()
+            
             return adapter_dir
             
         except Exception as e:
@@ -422,16 +889,16 @@ class ModelService:
             adapter_weights = {}
             
             # Get the state dict file path
-            state_dict_path = os.path.join(adapter_path, "adapter_model.bin")
+            self._convert_adapter_to_safetensors(adapter_path)
+            state_dict_path = os.path.join(adapter_path, "adapter_model.safetensors")
             if not os.path.exists(state_dict_path):
                 raise ValueError(f"Adapter state dict not found at {state_dict_path}")
             
-            # Load the state dict
-            state_dict = torch.load(state_dict_path, map_location="cpu")
-            
-            # Convert tensor weights to lists for easier serialization
-            for key, tensor in state_dict.items():
-                adapter_weights[key] = tensor.cpu().numpy().tolist()
+            # Read tensors one at a time from the memory-mapped file
+            with safe_open(state_dict_path, framework="pt", device="cpu") as f:
+                for key in f.keys():
+                    # Convert tensor weights to lists for easier serialization
+                    adapter_weights[key] = f.get_tensor(key).numpy().tolist()
             
             return adapter_weights
             
@@ -439,6 +906,46 @@ class ModelService:
             logger.error(f"Error extracting adapter weights: {str(e)}")
             raise
     
+    def _convert_model_to_safetensors(self, model, model_path):
+        """Re-save a model downloaded before weights were stored as safetensors."""
+        legacy_path = os.path.join(model_path, "pytorch_model.bin")
+        if not os.path.exists(legacy_path) or os.path.exists(os.path.join(model_path, "model.safetensors")):
+            return
+        
+        try:
+            model.save_pretrained(model_path, safe_serialization=True)
+            os.remove(legacy_path)
+            logger.info(f"Converted model weights in {model_path} to safetensors")
+        except Exception as e:
+            logger.warning(f"Could not convert model weights in {model_path} to safetensors: {str(e)}")
+    
+    def _convert_adapter_to_safetensors(self, adapter_path):
+        """Re-save an adapter saved before adapters were stored as safetensors."""
+        legacy_path = os.path.join(adapter_path, "adapter_model.bin")
+        safetensors_path = os.path.join(adapter_path, "adapter_model.safetensors")
+        if not os.path.exists(legacy_path) or os.path.exists(safetensors_path):
+            return
+        
+        try:
+            state_dict = torch.load(legacy_path, map_location="cpu")
+            save_file({key: tensor.contiguous() for key, tensor in state_dict.items()}, safetensors_path)
+            os.remove(legacy_path)
+            logger.info(f"Converted adapter {adapter_path} to safetensors")
+        except Exception as e:
+            logger.warning(f"Could not convert adapter {adapter_path} to safetensors: {str(e)}")
+    
+    def _peak_rss_mb(self):
+        """Peak resident memory of this process in MB, or None where it can't be measured."""
+        if resource is None:
+            return None
+        
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        
+        # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+        if sys.platform == 'darwin':
+            return round(peak / (1024 * 1024), 2)
+        return round(peak / 1024, 2)
+    
     def merge_server_weights(self, server_weights):
         """Merge server-provided weights into the current adapter."""
         if not self.is_model_loaded() or not hasattr(self.model, "peft_config"):
@@ -462,7 +969,8 @@ class ModelService:
                         logger.warning(f"Shape mismatch for key {key}: expected {state_dict[key].shape}, got {weight_tensor.shape}")
             
             # Load the merged state dict back into the model
-            self.model.load_state_dict(state_dict)
+            with self.weights_lock:
+                self.model.load_state_dict(state_dict)
             
             # Save the updated adapter
             adapter_dir = self.save_trained_adapter()
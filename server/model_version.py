@@ -0,0 +1,34 @@
+import time
+
+class ModelVersion:
+    def __init__(self, number, model, precision):
+        """
+        A published inference model that is never modified after publishing.
+        
+        Training and weight merges work on their own copy of the weights and
+        publish a new version when done; the old version stays usable by
+        whoever still holds it.
+        
+        Args:
+            number (int): Version number, increasing with every publish.
+            model: The inference model.
+            precision (str): Precision the model runs at.
+        """
+        model.eval()
+        model.requires_grad_(False)
+        
+        object.__setattr__(self, 'number', number)
+        object.__setattr__(self, 'model', model)
+        object.__setattr__(self, 'precision', precision)
+        object.__setattr__(self, 'published_at', time.time())
+    
+    def __setattr__(self, name, value):
+        raise AttributeError("ModelVersion is immutable")
+    
+    def get_stats(self):
+        """Get the version number, precision and publish time."""
+        return {
+            'number': self.number,
+            'precision': self.precision,
+            'published_at': self.published_at
+        }
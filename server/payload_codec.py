@@ -0,0 +1,93 @@
+import json
+import zlib
+import logging
+
+# zstandard is optional; zlib is used when it isn't installed
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+# First byte of a compressed payload identifies the compressor
+ZLIB_TAG = b'\x01'
+ZSTD_TAG = b'\x02'
+
+class PayloadCodec:
+    def __init__(self, compression='zlib', min_size=512, level=None):
+        """
+        Initialize a payload codec.
+        
+        Payloads are serialized as compact JSON. Payloads of at least
+        min_size bytes are also compressed and stored as a tagged BLOB;
+        smaller ones stay plain JSON text, which is what legacy rows hold.
+        
+        Args:
+            compression (str): 'none', 'zlib' or 'zstd' (falls back to zlib if unavailable).
+            min_size (int): Smallest serialized payload worth compressing, in bytes.
+            level (int, optional): Compression level.
+        """
+        if compression == 'zstd' and zstandard is None:
+            logger.info("zstandard not installed, using zlib for payload compression")
+            compression = 'zlib'
+        
+        if compression not in ('none', 'zlib', 'zstd'):
+            raise ValueError(f"Unknown payload compression: {compression}")
+        
+        self.compression = compression
+        self.min_size = min_size
+        
+        if compression == 'zlib':
+            self.level = level if level is not None else 6
+        elif compression == 'zstd':
+            self.level = level if level is not None else 3
+    
+    def encode(self, value):
+        """
+        Encode a JSON-serializable value for storage.
+        
+        Returns:
+            str or bytes: Compact JSON text, or a tagged compressed BLOB.
+        """
+        text = json.dumps(value, separators=(',', ':'))
+        if self.compression == 'none' or len(text) < self.min_size:
+            return text
+        
+        raw = text.encode('utf-8')
+        if self.compression == 'zstd':
+            # Compressor objects aren't thread safe, so use one per call
+            return ZSTD_TAG + zstandard.ZstdCompressor(level=self.level).compress(raw)
+        return ZLIB_TAG + zlib.compress(raw, self.level)
+    
+    def decode(self, data):
+        """
+        Decode a stored payload, whichever codec wrote it.
+        
+        Returns:
+            The decoded value, or None if data is None.
+        """
+        if data is None:
+            return None
+        
+        if isinstance(data, str):
+            return json.loads(data)
+        
+        data = bytes(data)
+        tag, body = data[:1], data[1:]
+        
+        if tag == ZLIB_TAG:
+            return json.loads(zlib.decompress(body))
+        
+        if tag == ZSTD_TAG:
+            if zstandard is None:
+                raise ValueError("Payload is zstd-compressed but zstandard is not installed")
+            return json.loads(zstandard.ZstdDecompressor().decompress(body))
+        
+        # Untagged bytes: plain JSON stored as a BLOB
+        return json.loads(data)
@@ -0,0 +1,73 @@
+import logging
+import torch
+from peft import PeftModel
+from transformers.pytorch_utils import Conv1D
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+INFERENCE_PRECISIONS = ('fp32', 'bf16', 'int8')
+
+def convert_for_inference(model, precision):
+    """
+    Turn a copy of the training model into an inference model.
+    
+    LoRA adapters are merged into the base weights first. 'bf16' then casts
+    the weights to bfloat16; 'int8' applies dynamic int8 quantization to the
+    Linear layers, which only runs on CPU.
+    
+    Args:
+        model: A copy of the model; it is modified and must not be the training model.
+        precision (str): One of INFERENCE_PRECISIONS.
+    
+    Returns:
+        The inference model.
+    """
+    if precision not in INFERENCE_PRECISIONS:
+        raise ValueError(f"Unknown inference precision: {precision}")
+    
+    if isinstance(model, PeftModel):
+        model = model.merge_and_unload()
+    
+    model.eval()
+    
+    if precision == 'bf16':
+        model = model.to(torch.bfloat16)
+    elif precision == 'int8':
+        if next(model.parameters()).is_cuda:
+            raise ValueError("int8 inference is only supported on CPU")
+        
+        # GPT-2 style models use Conv1D, which dynamic quantization doesn't recognize
+        _replace_conv1d(model)
+        model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    
+    return model
+
+def model_memory_bytes(model):
+    """Memory used by a model's weights and buffers, including packed quantized weights."""
+    total = 0
+    for value in model.state_dict().values():
+        # Quantized Linear layers store (weight, bias) tuples
+        tensors = value if isinstance(value, (tuple, list)) else [value]
+        for tensor in tensors:
+            if isinstance(tensor, torch.Tensor):
+                total += tensor.nelement() * tensor.element_size()
+    return total
+
+def _replace_conv1d(module):
+    """Replace Conv1D layers with equivalent Linear layers, in place."""
+    for name, child in module.named_children():
+        if isinstance(child, Conv1D):
+            in_features, out_features = child.weight.shape
+            linear = torch.nn.Linear(in_features, out_features, device=child.weight.device, dtype=child.weight.dtype)
+            with torch.no_grad():
+                # Conv1D computes x @ W, Linear computes x @ W.T
+                linear.weight.copy_(child.weight.t())
+                linear.bias.copy_(child.bias)
+            setattr(module, name, linear)
+        else:
+            _replace_conv1d(child)
@@ -6,6 +6,8 @@ import threading
 import uuid
 import json
 import sys
+import atexit
+import signal
 
 # Add the parent directory to the Python path to allow importing the mock services
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -321,6 +323,15 @@ def sync_status():
 def sync_schedule():
     return jsonify(database.get_sync_schedule())
 
+@app.route('/api/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok'})
+
+@app.route('/api/ready', methods=['GET'])
+def ready():
+    # The mock model service has nothing to load
+    return jsonify({'ready': True, 'status': 'ready', 'model_loaded': model_service.is_model_loaded()})
+
 @app.route('/')
 def home():
     return jsonify({
@@ -339,5 +350,12 @@ if __name__ == '__main__':
     # Initialize the database
     database.initialize()
     
+    # Persist chat turns in the background unless the user asked for synchronous writes
+    database.set_durability_mode(database.get_setting('durability_mode', 'write_behind'))
+    
+    # Flush queued writes on shutdown, including when the launcher terminates us
+    atexit.register(database.close)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    
     # Start the Flask server
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,202 @@
+import torch
+
+from kv_cache import KVCacheStore
+
+class DraftModel:
+    def __init__(self, model, model_id, num_draft_tokens=4):
+        """
+        A small model that drafts tokens for the target model to verify.
+        
+        The draft keeps its own KV cache for the request it is drafting for,
+        so each step only feeds it the tokens it hasn't seen yet.
+        
+        Args:
+            model: The draft model; must share the target model's tokenizer.
+            model_id (str): ID of the draft model.
+            num_draft_tokens (int): Tokens drafted per verification step.
+        """
+        self.model = model
+        self.model_id = model_id
+        self.num_draft_tokens = num_draft_tokens
+        
+        self.request = None
+        self.past_key_values = None
+        self.length = 0  # Tokens covered by the draft KV cache
+        
+        self.stats = {
+            'steps': 0,
+            'drafted_tokens': 0,
+            'accepted_tokens': 0
+        }
+    
+    def propose(self, request, sequence, num_tokens, probs_fn):
+        """
+        Draft tokens that follow a sequence.
+        
+        Args:
+            request: The request being decoded; the draft cache is reset when it changes.
+            sequence (list): Token IDs so far.
+            num_tokens (int): Number of tokens to draft.
+            probs_fn (callable): Maps (context token IDs, logits) to the sampling distribution.
+        
+        Returns:
+            tuple: (drafted token IDs, the distribution each one was sampled from).
+        """
+        if request is not self.request:
+            self.request = request
+            self.past_key_values = None
+            self.length = 0
+        
+        device = next(self.model.parameters()).device
+        context = list(sequence)
+        pending = context[self.length:]
+        
+        tokens = []
+        probs = []
+        with torch.no_grad():
+            for _ in range(num_tokens):
+                outputs = self.model(
+                    input_ids=torch.tensor([pending], dtype=torch.long, device=device),
+                    past_key_values=self.past_key_values,
+                    position_ids=torch.arange(
+                        self.length, self.length + len(pending), dtype=torch.long, device=device
+                    ).unsqueeze(0),
+                    use_cache=True
+                )
+                self.past_key_values = outputs.past_key_values
+                self.length += len(pending)
+                
+                p = probs_fn(context, outputs.logits[0, -1])
+                token = int(torch.multinomial(p, num_samples=1))
+                
+                tokens.append(token)
+                probs.append(p)
+                context.append(token)
+                pending = [token]
+        
+        return tokens, probs
+    
+    def rollback(self, length):
+        """Forget draft cache positions past the verified part of the sequence."""
+        if self.past_key_values is not None and self.length > length:
+            self.past_key_values = KVCacheStore.crop(self.past_key_values, length)
+            self.length = length
+    
+    def record(self, drafted, accepted):
+        """Count the outcome of one verification step."""
+        self.stats['steps'] += 1
+        self.stats['drafted_tokens'] += drafted
+        self.stats['accepted_tokens'] += accepted
+    
+    def get_stats(self):
+        """Get acceptance statistics."""
+        stats = dict(self.stats)
+        stats['draft_model'] = self.model_id
+        stats['acceptance_rate'] = (
+            stats['accepted_tokens'] / stats['drafted_tokens'] if stats['drafted_tokens'] else 0
+        )
+        
+        # Every step also yields one token sampled from the target model
+        stats['tokens_per_step'] = (
+            (stats['accepted_tokens'] + stats['steps']) / stats['steps'] if stats['steps'] else 0
+        )
+        return stats
+
+class PromptLookupProposer:
+    def __init__(self, num_draft_tokens=4, max_ngram=3, min_ngram=1):
+        """
+        Propose continuations by finding the latest n-gram in the earlier tokens.
+        
+        Replies often repeat phrasing from earlier in the conversation, so
+        the tokens that followed the last earlier occurrence of the current
+        n-gram make a free draft.
+        
+        Args:
+            num_draft_tokens (int): Maximum tokens proposed per step.
+            max_ngram (int): Longest n-gram matched; longer matches are tried first.
+            min_ngram (int): Shortest n-gram matched.
+        """
+        self.num_draft_tokens = num_draft_tokens
+        self.max_ngram = max_ngram
+        self.min_ngram = min_ngram
+        
+        self.stats = {
+            'steps': 0,
+            'misses': 0,
+            'drafted_tokens': 0,
+            'accepted_tokens': 0
+        }
+    
+    def propose(self, sequence, num_tokens):
+        """
+        Propose tokens that follow a sequence.
+        
+        Returns:
+            list: Proposed token IDs; empty when no n-gram matches.
+        """
+        for n in range(min(self.max_ngram, len(sequence) - 1), self.min_ngram - 1, -1):
+            tail = sequence[-n:]
+            
+            # Latest earlier occurrence first; it is the most likely to continue the same way
+            for start in range(len(sequence) - n - 1, -1, -1):
+                if sequence[start:start + n] == tail:
+                    continuation = sequence[start + n:start + n + num_tokens]
+                    if continuation:
+                        return continuation
+        
+        self.stats['misses'] += 1
+        return []
+    
+    def record(self, drafted, accepted):
+        """Count the outcome of one verification step."""
+        self.stats['steps'] += 1
+        self.stats['drafted_tokens'] += drafted
+        self.stats['accepted_tokens'] += accepted
+    
+    def get_stats(self):
+        """Get acceptance statistics."""
+        stats = dict(self.stats)
+        stats['acceptance_rate'] = (
+            stats['accepted_tokens'] / stats['drafted_tokens'] if stats['drafted_tokens'] else 0
+        )
+        stats['tokens_per_step'] = (
+            (stats['accepted_tokens'] + stats['steps']) / stats['steps'] if stats['steps'] else 0
+        )
+        return stats
+
+def verify_draft(drafts, draft_probs, target_probs, bonus_probs_fn):
+    """
+    Accept or reject drafted tokens so the output follows the target distribution.
+    
+    Token i is accepted with probability min(1, p(x) / q(x)); the first
+    rejected token is replaced by a sample from the normalized max(0, p - q).
+    If every token is accepted, one more token is sampled from the target.
+    
+    Args:
+        drafts (list): Drafted token IDs.
+        draft_probs (list): Draft distribution q for each drafted token, or None
+                            for a deterministic proposal (q is 1 at the token).
+        target_probs (callable): Maps an index i to the target distribution p for drafts[i].
+        bonus_probs_fn (callable): Returns the target distribution after all drafts.
+    
+    Returns:
+        tuple: (number of accepted drafts, the token that follows them).
+    """
+    for i, token in enumerate(drafts):
+        p = target_probs(i)
+        q = draft_probs[i]
+        q_token = float(q[token]) if q is not None else 1.0
+        
+        if float(torch.rand(())) * q_token <= float(p[token]):
+            continue
+        
+        if q is not None:
+            residual = torch.clamp(p - q, min=0)
+        else:
+            residual = p.clone()
+            residual[token] = 0
+        total = float(residual.sum())
+        replacement = residual / total if total > 0 else p
+        return i, int(torch.multinomial(replacement, num_samples=1))
+    
+    return len(drafts), int(torch.multinomial(bonus_probs_fn(), num_samples=1))
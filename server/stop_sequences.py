@@ -0,0 +1,97 @@
+from transformers import StoppingCriteria
+
+# Where GPT-2 starts writing the next user turn itself
+DEFAULT_STOP_SEQUENCES = ("\nUser:",)
+
+class StopSequenceCriteria(StoppingCriteria):
+    def __init__(self, tokenizer, stop_sequences, prompt_length):
+        """
+        Stop generation once the generated text contains a stop sequence.
+        
+        Only the last few generated tokens are decoded at each step, enough
+        to cover the longest stop sequence, so the check stays cheap however
+        long the reply gets.
+        
+        Args:
+            tokenizer: The tokenizer of the loaded model.
+            stop_sequences (list): Strings that end the reply.
+            prompt_length (int): Number of prompt tokens before the generated ones.
+        """
+        self.tokenizer = tokenizer
+        self.stop_sequences = [s for s in stop_sequences if s]
+        self.prompt_length = prompt_length
+        
+        # Tokens decode to at least one character, apart from partial UTF-8 bytes
+        self.window = max((len(s) for s in self.stop_sequences), default=0) + 2
+    
+    def __call__(self, input_ids, scores, **kwargs):
+        if not self.stop_sequences:
+            return False
+        
+        generated = input_ids[0][self.prompt_length:]
+        tail = self.tokenizer.decode(generated[-self.window:], skip_special_tokens=True)
+        return any(s in tail for s in self.stop_sequences)
+
+def trim_at_stop(text, stop_sequences):
+    """
+    Cut text at the earliest stop sequence.
+    
+    Returns:
+        tuple: (text before the stop sequence, whether one was found).
+    """
+    positions = [text.find(s) for s in stop_sequences if s and s in text]
+    if not positions:
+        return text, False
+    return text[:min(positions)], True
+
+class StopSequenceBuffer:
+    def __init__(self, stop_sequences):
+        """
+        Filter streamed text so no part of a stop sequence is ever emitted.
+        
+        Text that could be the start of a stop sequence is held back until
+        the following text shows whether it is one.
+        
+        Args:
+            stop_sequences (list): Strings that end the reply.
+        """
+        self.stop_sequences = [s for s in stop_sequences if s]
+        self.pending = ""
+        self.stopped = False
+    
+    def push(self, text):
+        """
+        Add streamed text.
+        
+        Returns:
+            str: Text that is safe to emit now.
+        """
+        if self.stopped:
+            return ""
+        
+        self.pending += text
+        trimmed, found = trim_at_stop(self.pending, self.stop_sequences)
+        if found:
+            self.stopped = True
+            self.pending = ""
+            return trimmed
+        
+        # Hold back the longest suffix that a stop sequence starts with
+        held = 0
+        for s in self.stop_sequences:
+            for length in range(min(len(s) - 1, len(self.pending)), held, -1):
+                if self.pending.endswith(s[:length]):
+                    held = length
+                    break
+        
+        ready = self.pending[:len(self.pending) - held]
+        self.pending = self.pending[len(self.pending) - held:]
+        return ready
+    
+    def finish(self):
+        """Get any held-back text once the stream has ended."""
+        if self.stopped:
+            return ""
+        
+        ready, self.pending = self.pending, ""
+        return ready
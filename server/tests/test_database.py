@@ -0,0 +1,155 @@
+import os
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import Database
+
+@pytest.fixture
+def database(tmp_path):
+    db = Database(db_path=str(tmp_path / 'database' / 'psychpal.db'))
+    db.initialize()
+    yield db
+    db.close()
+
+def chat(*contents):
+    """Alternating user/assistant messages."""
+    return [
+        {'role': 'user' if index % 2 == 0 else 'assistant', 'content': content, 'timestamp': time.time()}
+        for index, content in enumerate(contents)
+    ]
+
+def save_legacy_conversation(database, conversation_id, messages):
+    """Store a conversation the way it was stored before the messages table existed."""
+    data = database.codecs['conversations'].encode({'id': conversation_id, 'title': 'Legacy', 'messages': messages})
+    with database.lock, database.get_connection() as conn:
+        conn.execute('''
+        INSERT INTO conversations (id, title, created_at, updated_at, data, storage_version)
+        VALUES (?, 'Legacy', ?, ?, ?, 0)
+        ''', (conversation_id, time.time(), time.time(), data))
+
+def pair_outputs(pairs):
+    return sorted(pair['output'] for pair in pairs)
+
+def test_full_pass_sees_conversations_migrated_between_phases(database, monkeypatch):
+    database.save_conversation({'id': 'new', 'messages': chat('hi', 'hello')})
+    save_legacy_conversation(database, 'legacy-1', chat('a', 'b'))
+    save_legacy_conversation(database, 'legacy-2', chat('c', 'd', 'e', 'f'))
+
+    # Let the migration run just before the blob phase reads
+    iter_blob_pairs = database._iter_blob_pairs
+    def migrate_then_iter_blob_pairs(reads):
+        database._migrate_messages(batch_size=50, pause=0)
+        return iter_blob_pairs(reads)
+    monkeypatch.setattr(database, '_iter_blob_pairs', migrate_then_iter_blob_pairs)
+
+    assert pair_outputs(database.iter_training_pairs()) == ['b', 'd', 'f', 'hello']
+    assert not database._has_unmigrated_conversations()
+
+def test_search_falls_back_to_like_scan_without_fts(database):
+    database.save_conversation({'id': 'c1', 'title': 'Sleep', 'messages': chat('I can not sleep at night', 'Try a 100% calm routine')})
+    database.save_conversation({'id': 'c2', 'title': 'Work', 'messages': chat('Work is stressful', 'Take breaks')})
+
+    fts_results = database.search_messages('sleep night')
+    database.fts_enabled = False
+    like_results = database.search_messages('sleep night')
+
+    for results in (fts_results, like_results):
+        assert [(result['conversation_id'], result['seq']) for result in results] == [('c1', 0)]
+        assert '[sleep]' in results[0]['snippet']
+
+    # Wildcards in the query match literally
+    assert [result['seq'] for result in database.search_messages('100%')] == [1]
+    assert database.search_messages('1_0') == []
+
+def test_search_falls_back_to_like_scan_when_index_is_missing(database):
+    database.save_conversation({'id': 'c1', 'messages': chat('feeling anxious today', 'That sounds hard')})
+    with database.lock, database.get_connection() as conn:
+        conn.execute('DROP TABLE messages_fts')
+
+    results = database.search_messages('anxious')
+    assert [(result['conversation_id'], result['seq']) for result in results] == [('c1', 0)]
+    assert results[0]['snippet'] == 'feeling [anxious] today'
+
+def test_dropped_queued_write_is_counted_and_uncached(database):
+    database.save_conversation({'id': 'c1', 'messages': chat('hi', 'hello')})
+    database.set_durability_mode('write_behind', flush_interval=0.01)
+    with database.lock, database.get_connection() as conn:
+        conn.execute('''
+        CREATE TRIGGER reject_boom BEFORE INSERT ON messages WHEN new.content = 'boom'
+        BEGIN SELECT RAISE(ABORT, 'rejected'); END
+        ''')
+
+    database.append_messages('c1', chat('boom'))
+    database.flush()
+
+    failures = database.get_cache_stats()['write_failures']
+    assert failures['count'] == 1
+    assert 'rejected' in failures['last_error']
+
+    # The cache no longer serves the message SQLite never stored
+    assert [message['content'] for message in database.get_conversation('c1')['messages']] == ['hi', 'hello']
+
+def test_summary_pages_are_stable_across_ties_and_new_writes(database):
+    for index in range(7):
+        database.save_conversation({'id': f"c{index}", 'title': f"Chat {index}", 'messages': chat('hi')})
+
+    # Several conversations share one updated_at; the ID breaks the tie
+    with database.lock, database.get_connection() as conn:
+        conn.execute("UPDATE conversations SET updated_at = 100.0 WHERE id IN ('c1', 'c2', 'c3', 'c4')")
+
+    seen = []
+    page = database.list_conversation_summaries(limit=3)
+    while True:
+        seen.extend(summary['id'] for summary in page['conversations'])
+
+        # Conversations updated mid-pagination move ahead of the cursor and don't shift later pages
+        database.append_messages(f"new-{len(seen)}", chat('hello'))
+
+        if page['next_cursor'] is None:
+            break
+        page = database.list_conversation_summaries(limit=3, after_cursor=page['next_cursor'])
+
+    assert seen == ['c6', 'c5', 'c0', 'c4', 'c3', 'c2', 'c1']
+
+def test_invalid_summary_cursor_is_rejected(database):
+    with pytest.raises(ValueError):
+        database.list_conversation_summaries(after_cursor='not-a-cursor')
+
+def test_incremental_pass_only_yields_pairs_past_the_watermark(database):
+    database.save_conversation({'id': 'old', 'messages': chat('q1', 'a1', 'q2', 'a2')})
+    save_legacy_conversation(database, 'legacy', chat('lq', 'la'))
+    watermark = database.get_message_watermark()
+
+    database.save_training_metadata({'id': 'run-1', 'model_id': 'model-a', 'watermark': watermark})
+    database.save_training_metadata({'id': 'run-2', 'model_id': 'model-b', 'watermark': 1})
+    assert database.get_training_watermark('model-a') == watermark
+    assert database.get_training_watermark('model-b') == 1
+    assert database.get_training_watermark('model-c') is None
+
+    # Rewriting an already trained conversation keeps its message IDs; rows moved
+    # out of legacy blobs get new IDs but were trained on before
+    database.save_conversation({'id': 'old', 'messages': chat('q1', 'a1 edited', 'q2', 'a2')})
+    database._migrate_messages(batch_size=50, pause=0)
+    database.append_messages('old', chat('q3', 'a3'))
+    database.append_messages('new', chat('q4', 'a4', 'q5', 'a5'))
+    until = database.get_message_watermark()
+    database.append_messages('new', chat('q6', 'a6'))
+
+    pairs = database.iter_training_pairs(batch_size=1, after_id=watermark, until_id=until)
+    assert [pair['output'] for pair in pairs] == ['a3', 'a4', 'a5']
+
+    # A full pass still covers everything up to the bound
+    full = database.iter_training_pairs(batch_size=2, until_id=until)
+    assert pair_outputs(full) == ['a1 edited', 'a2', 'a3', 'a4', 'a5', 'la']
+
+def test_replay_samples_older_pairs(database):
+    database.save_conversation({'id': 'old', 'messages': chat(*[f"m{index}" for index in range(40)])})
+    watermark = database.get_message_watermark()
+    database.append_messages('new', chat('q', 'a'))
+
+    assert pair_outputs(database.iter_training_pairs(after_id=watermark, replay_fraction=0.0)) == ['a']
+    assert len(list(database.iter_training_pairs(after_id=watermark, replay_fraction=1.0))) == 21
@@ -0,0 +1,95 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+pytest.importorskip('peft')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_service import ModelService
+from inference_engine import InferenceEngine
+
+VOCAB_SIZE = 64
+REPETITION_PENALTY = 1.2
+
+class FakeTokenizer:
+    """Just enough of a tokenizer for the inference engine."""
+    eos_token_id = None
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return ' '.join(str(token) for token in token_ids)
+
+@pytest.fixture
+def model_service(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    torch.manual_seed(0)
+
+    service = ModelService()
+    service.stop_sequences = []
+    config = transformers.GPT2Config(n_layer=2, n_embd=32, n_head=2, vocab_size=VOCAB_SIZE, n_positions=128)
+    model = transformers.GPT2LMHeadModel(config)
+
+    with service.model_lock, service.publish_lock:
+        service.model = model
+        service.tokenizer = FakeTokenizer()
+        service._publish(model, 'fp32')
+    return service
+
+def use_greedy_engine(model_service, prefill_chunk_size):
+    # top_k=1 leaves only the most likely token, so sampling is greedy
+    model_service.engine = InferenceEngine(
+        model_service, prefill_chunk_size=prefill_chunk_size, top_k=1, repetition_penalty=REPETITION_PENALTY
+    )
+    return model_service.engine
+
+def reference(model_service, prompt, max_new_tokens):
+    """Greedy generate() with the engine's repetition penalty."""
+    model = model_service.published.model
+    with torch.no_grad():
+        output = model.generate(
+            torch.tensor([prompt]),
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            repetition_penalty=REPETITION_PENALTY,
+            pad_token_id=0
+        )
+    return output[0, len(prompt):].tolist()
+
+PROMPTS = [
+    [5, 9, 13],
+    [7, 1, 2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12],
+    [30, 31, 40, 41, 50, 51, 60],
+    [2] * 20 + [3, 4]
+]
+
+@pytest.mark.parametrize('prefill_chunk_size', [256, 4])
+def test_batched_greedy_output_matches_generate(model_service, prefill_chunk_size):
+    engine = use_greedy_engine(model_service, prefill_chunk_size)
+
+    # Submitted together, so the prompts are prefilled and decoded as one padded batch
+    requests = [engine.submit(prompt, max_new_tokens=12) for prompt in PROMPTS]
+    for prompt, request in zip(PROMPTS, requests):
+        assert request.result(timeout=60) == reference(model_service, prompt, 12)
+
+    stats = engine.get_stats()
+    assert stats['average_batch_size'] > 1
+    if prefill_chunk_size == 4:
+        assert stats['prefill_chunks'] > len(PROMPTS)
+
+def test_second_turn_reuses_the_kv_cache(model_service):
+    engine = use_greedy_engine(model_service, prefill_chunk_size=4)
+
+    first_prompt = PROMPTS[1]
+    first_reply = engine.submit(first_prompt, conversation_id='c1', max_new_tokens=6).result(timeout=60)
+    assert first_reply == reference(model_service, first_prompt, 6)
+
+    # The next turn extends the previous prompt and reply
+    second_prompt = first_prompt + first_reply + [20, 21, 22]
+    prefilled_before = engine.get_stats()['prefilled_tokens']
+    second_reply = engine.submit(second_prompt, conversation_id='c1', max_new_tokens=6).result(timeout=60)
+
+    assert second_reply == reference(model_service, second_prompt, 6)
+    assert engine.get_stats()['prefilled_tokens'] - prefilled_before < len(second_prompt)
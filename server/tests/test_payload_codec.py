@@ -0,0 +1,66 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import payload_codec
+from payload_codec import PayloadCodec, ZLIB_TAG, ZSTD_TAG
+
+PAYLOAD = {
+    'title': 'Évening check-in',
+    'messages': [{'role': 'user', 'content': 'I feel calm today 😊 ' * 50}],
+    'settings': {'nested': [1, 2.5, None, True]}
+}
+
+@pytest.mark.parametrize('compression', ['none', 'zlib', 'zstd'])
+def test_round_trip(compression):
+    codec = PayloadCodec(compression)
+    assert codec.decode(codec.encode(PAYLOAD)) == PAYLOAD
+
+def test_small_payloads_stay_plain_json():
+    codec = PayloadCodec('zlib', min_size=512)
+    encoded = codec.encode({'a': 1})
+    assert encoded == '{"a":1}'
+    assert codec.decode(encoded) == {'a': 1}
+
+def test_large_payloads_are_tagged_and_compressed():
+    encoded = PayloadCodec('zlib').encode(PAYLOAD)
+    assert isinstance(encoded, bytes)
+    assert encoded[:1] == ZLIB_TAG
+    assert len(encoded) < len(str(PAYLOAD))
+
+def test_zstd_falls_back_to_zlib_when_not_installed(monkeypatch):
+    monkeypatch.setattr(payload_codec, 'zstandard', None)
+    codec = PayloadCodec('zstd')
+
+    assert codec.compression == 'zlib'
+    encoded = codec.encode(PAYLOAD)
+    assert encoded[:1] == ZLIB_TAG
+    assert codec.decode(encoded) == PAYLOAD
+
+def test_any_codec_reads_rows_written_by_another():
+    zlib_encoded = PayloadCodec('zlib').encode(PAYLOAD)
+    plain_encoded = PayloadCodec('none').encode(PAYLOAD)
+
+    for codec in (PayloadCodec('none'), PayloadCodec('zlib'), PayloadCodec('zstd')):
+        assert codec.decode(zlib_encoded) == PAYLOAD
+        assert codec.decode(plain_encoded) == PAYLOAD
+
+def test_decodes_legacy_rows():
+    codec = PayloadCodec('zlib')
+    assert codec.decode(None) is None
+
+    # Legacy rows hold indented JSON, as text or as an untagged BLOB
+    assert codec.decode('{\n  "a": [1, 2]\n}') == {'a': [1, 2]}
+    assert codec.decode(memoryview(b'{"a": [1, 2]}')) == {'a': [1, 2]}
+
+def test_zstd_payload_without_zstandard_raises(monkeypatch):
+    monkeypatch.setattr(payload_codec, 'zstandard', None)
+    with pytest.raises(ValueError):
+        PayloadCodec('zlib').decode(ZSTD_TAG + b'not zlib either')
+
+def test_unknown_compression_is_rejected():
+    with pytest.raises(ValueError):
+        PayloadCodec('lz4')
@@ -0,0 +1,63 @@
+import os
+import sys
+
+import pytest
+
+torch = pytest.importorskip('torch')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from speculative import verify_draft
+
+VOCAB_SIZE = 5
+
+def one_hot(token):
+    probs = torch.zeros(VOCAB_SIZE)
+    probs[token] = 1.0
+    return probs
+
+def test_all_drafts_accepted_when_target_agrees():
+    drafts = [1, 2, 3]
+    accepted, token = verify_draft(
+        drafts,
+        [one_hot(token) for token in drafts],
+        lambda i: one_hot(drafts[i]),
+        lambda: one_hot(4)
+    )
+    assert (accepted, token) == (3, 4)
+
+def test_first_rejection_is_replaced_from_the_residual():
+    drafts = [1, 2, 3]
+    accepted, token = verify_draft(
+        drafts,
+        [one_hot(token) for token in drafts],
+        # The target agrees on the first draft and wants 0 instead of the second
+        lambda i: one_hot([1, 0, 3][i]),
+        lambda: pytest.fail("no bonus token after a rejection")
+    )
+    assert (accepted, token) == (1, 0)
+
+def test_rejected_deterministic_draft_is_never_resampled():
+    torch.manual_seed(0)
+    target = torch.tensor([0.0, 0.5, 0.5, 0.0, 0.0])
+
+    for _ in range(200):
+        accepted, token = verify_draft([2], [None], lambda i: target, lambda: target)
+        if accepted == 0:
+            assert token == 1
+        else:
+            assert token in (1, 2)
+
+def test_output_follows_the_target_distribution():
+    torch.manual_seed(0)
+    target = torch.tensor([0.1, 0.4, 0.2, 0.2, 0.1])
+    draft = torch.tensor([0.5, 0.1, 0.1, 0.1, 0.2])
+
+    samples = 20000
+    counts = torch.zeros(VOCAB_SIZE)
+    for _ in range(samples):
+        drafted = int(torch.multinomial(draft, num_samples=1))
+        accepted, token = verify_draft([drafted], [draft], lambda i: target, lambda: target)
+        counts[drafted if accepted else token] += 1
+
+    assert torch.allclose(counts / samples, target, atol=0.015)
@@ -0,0 +1,86 @@
+import multiprocessing
+import os
+import sys
+import traceback
+
+import pytest
+
+torch = pytest.importorskip('torch')
+transformers = pytest.importorskip('transformers')
+pytest.importorskip('peft')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from model_service import ModelService
+
+VOCAB_SIZE = 64
+
+class FakeTokenizer:
+    """Just enough of a tokenizer for the inference engine; picklable so it can be sent to the workers."""
+    eos_token_id = None
+
+    def decode(self, token_ids, skip_special_tokens=False):
+        return ' '.join(str(token) for token in token_ids)
+
+    def get_vocab(self):
+        return {str(token): token for token in range(VOCAB_SIZE)}
+
+def publish_tiny_model(model_service):
+    config = transformers.GPT2Config(n_layer=1, n_embd=32, n_head=2, vocab_size=VOCAB_SIZE, n_positions=64)
+    model = transformers.GPT2LMHeadModel(config)
+
+    with model_service.model_lock, model_service.publish_lock:
+        model_service.model = model
+        model_service._publish(model, 'fp32')
+    model_service._sync_workers()
+
+def run_two_worker_pool(directory):
+    """The test body; runs in a fresh interpreter so no torch op has run before the fork."""
+    os.chdir(directory)
+    model_service = ModelService()
+    model_service.start_workers(2)
+    assert model_service.workers is not None
+
+    try:
+        torch.manual_seed(0)
+        model_service.tokenizer = FakeTokenizer()
+        for _ in range(2):
+            # A second publish reaches the running workers without re-forking them
+            publish_tiny_model(model_service)
+
+            requests = [
+                model_service._submit([1, 2, 3, 4], conversation_id=f"conversation-{index}", max_new_tokens=5)
+                for index in range(8)
+            ]
+            for request in requests:
+                assert len(request.result(timeout=120)) == 5
+
+            stats = model_service.workers.get_stats()
+            assert stats['alive'] == 2
+            assert stats['synced_version'] == model_service.published.number
+
+        assert sum(stats['requests_per_worker']) == 2 * len(requests)
+        assert all(count > 0 for count in stats['requests_per_worker'])
+    finally:
+        model_service.stop_workers()
+
+def run_and_report(directory, errors):
+    try:
+        run_two_worker_pool(directory)
+    except BaseException:
+        errors.put(traceback.format_exc())
+        raise
+
+def test_requests_run_through_two_workers(tmp_path):
+    # Other tests run torch ops in this process, which makes forking from it unsafe
+    context = multiprocessing.get_context('spawn')
+    errors = context.Queue()
+    process = context.Process(target=run_and_report, args=(str(tmp_path), errors))
+    process.start()
+    process.join(300)
+
+    if process.is_alive():
+        process.kill()
+        pytest.fail("Two-worker pool run did not finish")
+    if process.exitcode != 0:
+        pytest.fail(errors.get(timeout=5) if not errors.empty() else f"exit code {process.exitcode}")
@@ -0,0 +1,79 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from write_queue import WriteBehindQueue
+
+def test_close_flushes_pending_writes():
+    applied = []
+    release = threading.Event()
+
+    def apply_batch(batch):
+        release.wait(5)
+        applied.extend(batch)
+
+    queue = WriteBehindQueue(apply_batch, flush_interval=0.01)
+    for value in range(10):
+        queue.submit(value)
+
+    # The worker is stuck on the first batch; close() must still wait for every write
+    release.set()
+    queue.close(timeout=5)
+
+    assert applied == list(range(10))
+    assert not queue.has_pending()
+    assert queue.get_stats()['operations'] == 10
+
+def test_submit_after_close_raises():
+    queue = WriteBehindQueue(lambda batch: None)
+    queue.close(timeout=5)
+
+    with pytest.raises(RuntimeError):
+        queue.submit('late')
+
+def test_failed_write_is_dropped_and_reported():
+    applied = []
+    failures = []
+
+    def apply_batch(batch):
+        if 'bad' in batch:
+            raise ValueError("constraint failed")
+        applied.extend(batch)
+
+    queue = WriteBehindQueue(
+        apply_batch, flush_interval=0.05, on_failure=lambda operation, error: failures.append((operation, str(error)))
+    )
+    for value in ('a', 'bad', 'b'):
+        queue.submit(value)
+
+    assert queue.flush(timeout=5)
+
+    # The rest of the batch is retried one write at a time and still applied
+    assert applied == ['a', 'b']
+    assert failures == [('bad', 'constraint failed')]
+    assert queue.get_stats()['failed_operations'] == 1
+    queue.close(timeout=5)
+
+def test_failing_callback_does_not_stop_the_queue():
+    applied = []
+
+    def apply_batch(batch):
+        if 'bad' in batch:
+            raise ValueError("constraint failed")
+        applied.extend(batch)
+
+    def on_failure(operation, error):
+        raise RuntimeError("callback broke")
+
+    queue = WriteBehindQueue(apply_batch, flush_interval=0.01, on_failure=on_failure)
+    queue.submit('bad')
+    assert queue.flush(timeout=5)
+
+    queue.submit('good')
+    assert queue.flush(timeout=5)
+    assert applied == ['good']
+    queue.close(timeout=5)
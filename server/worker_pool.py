@@ -0,0 +1,383 @@
+import os
+import bisect
+import hashlib
+import itertools
+import logging
+import multiprocessing
+import queue
+from threading import Event, Lock, RLock, Thread
+import torch
+import torch.multiprocessing as torch_multiprocessing
+
+from inference_engine import InferenceEngine
+from speculative import DraftModel, PromptLookupProposer
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class ConsistentHashRing:
+    def __init__(self, nodes, replicas=160):
+        """
+        Map keys to nodes so that each key keeps its node as long as the node exists.
+        
+        Args:
+            nodes (list): Node identifiers.
+            replicas (int): Points per node on the ring; more points spread keys more evenly.
+        """
+        self.ring = sorted(
+            (self._hash(f"{node}:{replica}"), node)
+            for node in nodes
+            for replica in range(replicas)
+        )
+        self.points = [point for point, _ in self.ring]
+    
+    def get(self, key):
+        """Get the node a key belongs to."""
+        index = bisect.bisect(self.points, self._hash(str(key))) % len(self.points)
+        return self.ring[index][1]
+    
+    def _hash(self, value):
+        """Stable across processes and restarts, unlike hash()."""
+        return int.from_bytes(hashlib.md5(value.encode('utf-8')).digest()[:8], 'big')
+
+class RemoteRequest:
+    def __init__(self, request_id, worker):
+        """
+        A request running in a worker process; mirrors InferenceRequest.
+        
+        Args:
+            request_id (int): ID of the request within the pool.
+            worker (int): Index of the worker process serving it.
+        """
+        self.request_id = request_id
+        self.worker = worker
+        
+        self.generated = []
+        self.pieces = queue.Queue()
+        self.done = Event()
+        self.error = None
+        
+        self.cancel_fn = None
+    
+    def stream(self):
+        """
+        Yield decoded text as it is generated.
+        
+        Raises the generation error, if any, once the stream ends.
+        """
+        while True:
+            piece = self.pieces.get()
+            if piece is None:
+                break
+            yield piece
+        
+        if self.error is not None:
+            raise self.error
+    
+    def result(self, timeout=None):
+        """
+        Wait for generation to finish.
+        
+        Returns:
+            list: The generated token IDs.
+        """
+        if not self.done.wait(timeout):
+            raise TimeoutError("Generation did not finish in time")
+        if self.error is not None:
+            raise self.error
+        return list(self.generated)
+    
+    def cancel(self):
+        """Stop generating for this request at the worker's next decode step."""
+        if not self.done.is_set() and self.cancel_fn is not None:
+            self.cancel_fn(self)
+    
+    def finish(self, generated=None, error=None):
+        """Mark the request as done; called by the pool."""
+        if generated is not None:
+            self.generated = generated
+        self.error = error
+        self.done.set()
+        self.pieces.put(None)
+
+class InferenceWorkerPool:
+    def __init__(self, model_service, num_workers, threads_per_worker=None):
+        """
+        Initialize a pool of forked inference worker processes.
+        
+        Workers are forked before the model is loaded, while torch hasn't
+        started its OpenMP thread pool, which doesn't survive a fork. Each
+        published model version is then sent to the live workers over their
+        queues; torch moves the weights into shared memory, so every worker
+        maps the same copy. Each worker runs its own InferenceEngine with its
+        own share of the CPU threads. Requests for a conversation always go
+        to the same worker, picked by consistent hashing of the conversation
+        ID, so its KV cache stays warm there.
+        
+        Args:
+            model_service (ModelService): The loaded model service to fork.
+            num_workers (int): Number of worker processes.
+            threads_per_worker (int, optional): Torch threads per worker; defaults
+                                                to an equal share of the CPU cores.
+        """
+        self.model_service = model_service
+        self.num_workers = num_workers
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        
+        # torch's context registers the reductions that share tensors instead of copying them
+        self.context = torch_multiprocessing.get_context('fork')
+        self.processes = []
+        self.request_queues = []
+        self.responses = self.context.Queue()
+        
+        self.ring = ConsistentHashRing(range(num_workers))
+        self.round_robin = itertools.cycle(range(num_workers))
+        self.request_ids = itertools.count()
+        
+        self.lock = Lock()
+        self.pending = {}  # request ID -> RemoteRequest
+        self.stopping = False
+        self.synced_version = None  # Number of the last version sent to the workers
+        
+        self.stats = {
+            'requests': [0] * num_workers,
+            'failed_workers': 0
+        }
+    
+    def start(self):
+        """Fork the worker processes; must run before the model is loaded."""
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            raise ValueError("Inference workers need a platform that supports fork")
+        if self.model_service.published is not None:
+            raise ValueError("Inference workers must be started before the model is loaded")
+        
+        engine = self.model_service.engine
+        engine_settings = {
+            'max_batch_size': engine.max_batch_size,
+            'prefill_chunk_size': engine.prefill_chunk_size
+        }
+        
+        for index in range(self.num_workers):
+            requests = self.context.Queue()
+            process = self.context.Process(
+                target=_worker_main,
+                args=(self.model_service, index, requests, self.responses, self.threads_per_worker, engine_settings),
+                name=f"inference-worker-{index}",
+                daemon=True
+            )
+            process.start()
+            
+            self.request_queues.append(requests)
+            self.processes.append(process)
+        
+        Thread(target=self._dispatch, daemon=True).start()
+        logger.info(f"Started {self.num_workers} inference workers with {self.threads_per_worker} threads each")
+    
+    def submit(self, token_ids, conversation_id=None, max_new_tokens=100, stream=False, adapter=None):
+        """
+        Queue a prompt on the worker that owns its conversation.
+        
+        Returns:
+            RemoteRequest: Use result() or stream() to get the output.
+        """
+        with self.lock:
+            if self.stopping:
+                raise ValueError("Inference workers are stopping")
+            
+            worker = self.ring.get(conversation_id) if conversation_id else next(self.round_robin)
+            request = RemoteRequest(next(self.request_ids), worker)
+            request.cancel_fn = self._cancel
+            
+            self.pending[request.request_id] = request
+            self.stats['requests'][worker] += 1
+        
+        self.request_queues[worker].put(
+            ('submit', request.request_id, list(token_ids), conversation_id, max_new_tokens, stream, adapter)
+        )
+        return request
+    
+    def sync(self, published, settings):
+        """
+        Send the published version, if it is new, and the serving settings to every worker.
+        
+        Args:
+            published (ModelVersion): The version to serve.
+            settings (dict): ModelService attributes the workers need; see _apply_sync().
+        """
+        with self.lock:
+            if published is not None and published.number != self.synced_version:
+                self.synced_version = published.number
+            else:
+                published = None
+        
+        for requests in self.request_queues:
+            requests.put(('sync', published, settings))
+    
+    def stop(self):
+        """Let the workers finish their requests, then shut them down in the background."""
+        with self.lock:
+            self.stopping = True
+        
+        for requests in self.request_queues:
+            requests.put(None)
+    
+    def get_stats(self):
+        """Get per-worker request counts and liveness."""
+        with self.lock:
+            return {
+                'workers': self.num_workers,
+                'threads_per_worker': self.threads_per_worker,
+                'alive': sum(1 for process in self.processes if process.is_alive()),
+                'in_flight': len(self.pending),
+                'synced_version': self.synced_version,
+                'requests_per_worker': list(self.stats['requests']),
+                'failed_workers': self.stats['failed_workers']
+            }
+    
+    def _cancel(self, request):
+        """Ask the request's worker to cancel it."""
+        self.request_queues[request.worker].put(('cancel', request.request_id))
+    
+    def _dispatch(self):
+        """Route worker responses to their requests until every worker has exited."""
+        failed = set()
+        while True:
+            try:
+                message = self.responses.get(timeout=1)
+            except queue.Empty:
+                # Fail the requests of workers that died
+                for index, process in enumerate(self.processes):
+                    if index not in failed and not process.is_alive():
+                        failed.add(index)
+                        self._fail_worker(index, process.exitcode)
+                
+                if len(failed) == len(self.processes):
+                    return
+                continue
+            
+            kind, request_id, payload = message
+            with self.lock:
+                request = self.pending.get(request_id)
+                if kind != 'piece':
+                    self.pending.pop(request_id, None)
+            
+            if request is None:
+                continue
+            
+            if kind == 'piece':
+                request.pieces.put(payload)
+            elif kind == 'done':
+                request.finish(generated=payload)
+            else:
+                request.finish(error=RuntimeError(payload))
+    
+    def _fail_worker(self, index, exitcode):
+        """Fail every pending request of a worker that exited."""
+        with self.lock:
+            requests = [request for request in self.pending.values() if request.worker == index]
+            for request in requests:
+                del self.pending[request.request_id]
+            if exitcode:
+                self.stats['failed_workers'] += 1
+        
+        if exitcode:
+            logger.error(f"Inference worker {index} exited with code {exitcode}")
+        for request in requests:
+            request.finish(error=RuntimeError(f"Inference worker {index} exited"))
+
+def _worker_main(model_service, index, requests, responses, num_threads, engine_settings):
+    """Serve requests in a forked worker process until told to stop."""
+    torch.set_num_threads(num_threads)
+    
+    # Locks may have been held by other threads of the parent when it forked,
+    # and its engine thread doesn't exist here
+    model_service.model_lock = RLock()
+    model_service.weights_lock = RLock()
+    model_service.rebuild_lock = Lock()
+    model_service.publish_lock = Lock()
+    model_service.workers = None
+    model_service.engine = InferenceEngine(model_service, **engine_settings)
+    
+    active = {}  # request ID -> InferenceRequest
+    relays = []
+    
+    def relay(request_id, request):
+        try:
+            if request.stream_text:
+                for piece in request.stream():
+                    responses.put(('piece', request_id, piece))
+            responses.put(('done', request_id, request.result()))
+        except Exception as e:
+            responses.put(('error', request_id, str(e)))
+        finally:
+            active.pop(request_id, None)
+    
+    logger.info(f"Inference worker {index} started (pid {os.getpid()})")
+    while True:
+        message = requests.get()
+        if message is None:
+            break
+        
+        if message[0] == 'sync':
+            _apply_sync(model_service, message[1], message[2])
+            continue
+        
+        if message[0] == 'cancel':
+            request = active.get(message[1])
+            if request is not None:
+                request.cancel()
+            continue
+        
+        _, request_id, token_ids, conversation_id, max_new_tokens, stream, adapter = message
+        request = model_service.engine.submit(token_ids, conversation_id, max_new_tokens, stream, adapter)
+        active[request_id] = request
+        
+        thread = Thread(target=relay, args=(request_id, request), daemon=True)
+        thread.start()
+        relays.append(thread)
+        relays = [thread for thread in relays if thread.is_alive()]
+    
+    # Finish in-flight requests before exiting
+    for thread in relays:
+        thread.join()
+    responses.close()
+    responses.join_thread()
+    logger.info(f"Inference worker {index} stopped")
+
+def _apply_sync(model_service, published, settings):
+    """
+    Apply a sync message in a worker.
+    
+    Args:
+        model_service (ModelService): The worker's copy of the service.
+        published (ModelVersion): A new version to serve, or None to keep the current one.
+        settings (dict): 'tokenizer', 'model_id', 'stop_sequences', 'draft'
+                         ((model, model ID) or None) and 'prompt_lookup' (bool).
+    """
+    draft = settings['draft']
+    
+    # Batches start under this lock, so none starts on a half-applied sync
+    with model_service.model_lock:
+        if published is not None:
+            model_service.published = published
+            
+            # Cached keys/values belong to the previous weights
+            model_service.kv_cache.clear()
+        
+        model_service.tokenizer = settings['tokenizer']
+        model_service.model_id = settings['model_id']
+        model_service.stop_sequences = settings['stop_sequences']
+        
+        if draft is None:
+            model_service.draft_model = None
+        elif model_service.draft_model is None or model_service.draft_model.model_id != draft[1]:
+            model_service.draft_model = DraftModel(draft[0], draft[1])
+        
+        if not settings['prompt_lookup']:
+            model_service.prompt_lookup = None
+        elif model_service.prompt_lookup is None:
+            model_service.prompt_lookup = PromptLookupProposer()
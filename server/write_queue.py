@@ -0,0 +1,157 @@
+import time
+import logging
+from threading import Condition, Thread
+
+# Configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+class WriteBehindQueue:
+    def __init__(self, apply_batch, flush_interval=0.005, max_batch=500, on_failure=None):
+        """
+        Initialize the write-behind queue.
+
+        Writes are collected for flush_interval seconds and then handed to
+        apply_batch together, so many small writes share one commit.
+
+        Args:
+            apply_batch (callable): Called from the worker thread with a list of
+                                    pending operations; must apply them atomically.
+            flush_interval (float): Seconds to gather writes before committing.
+            max_batch (int): Maximum number of operations per batch.
+            on_failure (callable, optional): Called from the worker thread with each
+                                             operation that could not be applied and
+                                             the error, after it has been dropped.
+        """
+        self.apply_batch = apply_batch
+        self.on_failure = on_failure
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+
+        self.pending = []
+        self.condition = Condition()
+        self.submitted = 0  # Sequence number of the last submitted operation
+        self.applied = 0  # Sequence number of the last applied operation
+        self.closed = False
+
+        self.stats = {
+            'batches': 0,
+            'operations': 0,
+            'failed_operations': 0
+        }
+
+        self.worker = Thread(target=self._run, daemon=True)
+        self.worker.start()
+
+    def submit(self, operation):
+        """
+        Queue an operation to be applied by the worker thread.
+
+        Args:
+            operation: Any value understood by apply_batch.
+
+        Returns:
+            int: The sequence number of the operation.
+        """
+        with self.condition:
+            if self.closed:
+                raise RuntimeError("Write queue is closed")
+
+            self.pending.append(operation)
+            self.submitted += 1
+            self.condition.notify_all()
+            return self.submitted
+
+    def has_pending(self):
+        """Check whether any submitted operation has not been applied yet."""
+        with self.condition:
+            return self.applied < self.submitted
+
+    def flush(self, timeout=None):
+        """
+        Wait until every operation submitted so far has been applied.
+
+        Args:
+            timeout (float, optional): Maximum number of seconds to wait.
+
+        Returns:
+            bool: True if everything was applied, False on timeout.
+        """
+        with self.condition:
+            target = self.submitted
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: self.applied >= target, timeout)
+
+    def close(self, timeout=None):
+        """Flush outstanding writes and stop the worker thread."""
+        with self.condition:
+            if self.closed:
+                return
+            self.closed = True
+            self.condition.notify_all()
+
+        self.worker.join(timeout)
+
+        if self.worker.is_alive():
+            logger.warning("Write queue did not finish flushing before shutdown")
+
+    def get_stats(self):
+        """Get counters describing how writes have been batched."""
+        with self.condition:
+            stats = dict(self.stats)
+            stats['pending'] = len(self.pending)
+            stats['average_batch_size'] = (
+                stats['operations'] / stats['batches'] if stats['batches'] else 0
+            )
+            return stats
+
+    def _run(self):
+        """Worker loop: gather writes for a short window, then apply them in one batch."""
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending or self.closed)
+                if not self.pending and self.closed:
+                    return
+
+            # Let concurrent writers join this batch
+            if not self.closed:
+                time.sleep(self.flush_interval)
+
+            with self.condition:
+                batch = self.pending[:self.max_batch]
+                del self.pending[:self.max_batch]
+
+            self._apply(batch)
+
+            with self.condition:
+                self.applied += len(batch)
+                self.condition.notify_all()
+
+    def _apply(self, batch):
+        """Apply a batch, falling back to one operation at a time if it fails."""
+        try:
+            self.apply_batch(batch)
+            self.stats['batches'] += 1
+            self.stats['operations'] += len(batch)
+            return
+        except Exception as e:
+            logger.error(f"Error applying write batch of {len(batch)} operations: {str(e)}")
+
+        # Retry individually so one bad write doesn't take the rest of the batch with it
+        for operation in batch:
+            try:
+                self.apply_batch([operation])
+                self.stats['batches'] += 1
+                self.stats['operations'] += 1
+            except Exception as e:
+                self.stats['failed_operations'] += 1
+                logger.error(f"Dropping write that failed to apply: {str(e)}")
+
+                if self.on_failure is not None:
+                    try:
+                        self.on_failure(operation, e)
+                    except Exception as callback_error:
+                        logger.error(f"Error handling failed write: {str(callback_error)}")
@@ -42,7 +42,8 @@ def create_standalone_package():
     app_files = [
         "desktop_app.py",
         "server/simplified_app.py",
-        "server/mock_services.py"
+        "server/mock_services.py",
+        "server/write_queue.py"
     ]
     
     for file_path in app_files: